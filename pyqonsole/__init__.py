@@ -11,6 +11,10 @@ widget
 """
 __revision__ = "$Id: __init__.py,v 1.6 2006-02-15 10:24:01 alf Exp $"
 
+import sys
+import time
+import traceback
+
 _QT_VERSION=3
 
 def require_qt(version):
@@ -45,23 +49,66 @@ class Signalable(object):
     """a class implementing a signal API similar to the qt's one"""
 
     def __init__(self, *args):
-        print self, args
         super(Signalable, self).__init__(*args)
+        # signal -> tuple of callbacks
         self.__connected = {}
         
     def myconnect(self, signal, callback):
         """connect the given callback to the signal"""
-        self.__connected.setdefault(signal, []).append(callback)
+        self.__connected[signal] = self.__connected.get(signal, ()) + (callback,)
         
     def mydisconnect(self, signal, callback):
         """disconnect the given callback from the signal"""
-        self.__connected[signal].remove(callback)
+        callbacks = list(self.__connected[signal])
+        callbacks.remove(callback)
+        self.__connected[signal] = tuple(callbacks)
         
     def myemit(self, signal, args=()):
         """emit the given signal with the given arguments if any"""
-        for callback in self.__connected.get(signal, []):
+        for callback in self.__connected.get(signal, ()):
+            try:
+                callback(*args)
+            except Exception:
+                traceback.print_exc()
+
+    def _myemitTimed(self, signal, args=()):
+        """myemit recording statistics, see enableSignalStats"""
+        start = time.time()
+        for callback in self.__connected.get(signal, ()):
             try:
                 callback(*args)
-            except:
-                import traceback
+            except Exception:
                 traceback.print_exc()
+        stats = SIGNAL_STATS.get(signal)
+        if stats is None:
+            stats = SIGNAL_STATS[signal] = [0, 0.0]
+        stats[0] += 1
+        stats[1] += time.time() - start
+
+
+# signal -> [number of emissions, time spent in callbacks]
+SIGNAL_STATS = {}
+_myemit = Signalable.__dict__['myemit']
+
+def enableSignalStats():
+    """record per signal statistics in SIGNAL_STATS. This has a cost, so
+    nothing is recorded unless enabled.
+    """
+    Signalable.myemit = Signalable.__dict__['_myemitTimed']
+
+def disableSignalStats():
+    """stop recording per signal statistics"""
+    Signalable.myemit = _myemit
+
+def printSignalStats(stream=None, limit=20):
+    """print signals statistics, sorted by decreasing time"""
+    stream = stream or sys.stderr
+    stats = [(seconds, calls, signal)
+             for signal, (calls, seconds) in SIGNAL_STATS.items()]
+    stats.sort()
+    stats.reverse()
+    print >> stream, '%10s %10s %10s  signal' % ('calls', 'total (ms)',
+                                                 'mean (us)')
+    for seconds, calls, signal in stats[:limit]:
+        print >> stream, '%10d %10.2f %10.2f  %s' % (
+            calls, seconds * 1000, seconds * 1000000 / calls, signal)
@@ -31,7 +31,7 @@ from pyqonsole.qtwrapper import qt, QEvent, ControlButton, ShiftButton, AltButto
 
 import pyqonsole.keytrans as kt
 from pyqonsole.emulation import Emulation, NOTIFYBELL, NOTIFYNORMAL
-from pyqonsole import CTRL, screen, widget, ca
+from pyqonsole import CTRL, screen, ca
 
 
 # VT102 modes
@@ -40,6 +40,7 @@ MODE_AppCuKeys = screen.MODES_SCREEN+1
 MODE_AppKeyPad = screen.MODES_SCREEN+2
 MODE_Mouse1000 = screen.MODES_SCREEN+3
 MODE_Ansi      = screen.MODES_SCREEN+4
+MODE_BracketedPaste = screen.MODES_SCREEN+5
 
 # Tokens
 TY_CHR = 0
@@ -62,6 +63,15 @@ def TY_VT52(A):
 def TY_CSI_PG(A):
     return ((ord(A) & 0xff) << 8) | 9
 
+# token classes (token & 0xff) by name, as counted in Emulation.token_counts
+TOKEN_CLASSES = {
+    'CHR': (0,),
+    'CTL': (1,),
+    'ESC': (2, 3, 4),
+    'CSI': (5, 6, 7, 9),
+    'VT52': (8,),
+    }
+
 # Character Classes used while decoding
 CTL = 1
 CHR = 2
@@ -161,7 +171,7 @@ class CharCodes:
 
     def applyCharset(self, c):
         if self.graphic and 0x5f <= c and c <= 0x7e:
-            return widget.VT100_GRAPHICS[c-0x5f]
+            return ca.VT100_GRAPHICS[c-0x5f]
         if self.pound and c == ord('#'):
             return 0xa3 # Obsolete mode
         if ord('[') <= c and c <= ord(']'):
@@ -227,12 +237,14 @@ class EmuVt102(Emulation):
         gui.myconnect("mouseSignal", self.onMouse)
         
     def reset(self):
+        self.wakeUp()
         self._resetToken()
         self._resetModes()
         self._resetCharset(0)
         self._resetCharset(1)
         self._screen[0].reset()
-        self._screen[1].reset()
+        if self._screen[1] is not None:
+            self._screen[1].reset()
         self._setCodec(0)
 
     # Processing the incoming byte stream #####################################
@@ -421,6 +433,7 @@ class EmuVt102(Emulation):
         The technical reference manual provides more informations
         about this mapping.
         """
+        self.token_counts[token & 0xff] += 1
         if token == TY_CHR: self._scr.showCharacter(p) # UTF16
     
         # 127 DEL: ignored on input
@@ -661,6 +674,11 @@ class EmuVt102(Emulation):
         #  FIXME: Modes 1000,1002 and 1003 have subtle differences which we don't
         #  support yet, we treat them all the same.
     
+        elif token == TY_CSI_PR('h', 2004): self.setMode(MODE_BracketedPaste)     # XTERM
+        elif token == TY_CSI_PR('l', 2004): self.resetMode(MODE_BracketedPaste)   # XTERM
+        elif token == TY_CSI_PR('s', 2004): self.saveMode(MODE_BracketedPaste)    # XTERM
+        elif token == TY_CSI_PR('r', 2004): self.restoreMode(MODE_BracketedPaste) # XTERM
+
         elif token == TY_CSI_PR('h', 1000): self.setMode(MODE_Mouse1000) # XTERM
         elif token == TY_CSI_PR('l', 1000): self.resetMode(MODE_Mouse1000) # XTERM
         elif token == TY_CSI_PR('s', 1000): self.saveMode(MODE_Mouse1000) # XTERM
@@ -683,7 +701,8 @@ class EmuVt102(Emulation):
     
         elif token == TY_CSI_PR('h', 1047): self.setMode(MODE_AppScreen) # XTERM
         elif token == TY_CSI_PR('l', 1047): # XTERM
-            self._screen[1].clearEntireScreen()
+            if self._screen[1] is not None:
+                self._screen[1].clearEntireScreen()
             self.resetMode(MODE_AppScreen)
         elif token == TY_CSI_PR('s', 1047): self.saveMode(MODE_AppScreen)    # XTERM
         elif token == TY_CSI_PR('r', 1047): self.restoreMode(MODE_AppScreen) # XTERM
@@ -698,7 +717,8 @@ class EmuVt102(Emulation):
         #        Here's a guess of what they could mean.
         elif token == TY_CSI_PR('h', 1049): # XTERM
             self._saveCursor()
-            self._screen[1].clearEntireScreen()
+            if self._screen[1] is not None:
+                self._screen[1].clearEntireScreen()
             self.setMode(MODE_AppScreen)
         elif token == TY_CSI_PR('l', 1049): # XTERM
             self.resetMode(MODE_AppScreen)
@@ -901,6 +921,14 @@ class EmuVt102(Emulation):
                 s.fill(chr(ev.ascii()), 1)
             self.sendString(str(s))
 
+    def _pasteBrackets(self):
+        """bracketed paste mode: the application wants pasted text between
+        ESC[200~ and ESC[201~
+        """
+        if self.getMode(MODE_BracketedPaste):
+            return '\033[200~', '\033[201~'
+        return '', ''
+
     # Charset related part of the emulation state #############################
     
     def _applyCharset(self, c):
@@ -947,6 +975,8 @@ class EmuVt102(Emulation):
         self.saveMode(MODE_Mouse1000)
         self.resetMode(MODE_AppScreen)
         self.saveMode(MODE_AppScreen)
+        self.resetMode(MODE_BracketedPaste)
+        self.saveMode(MODE_BracketedPaste)
         self.setMode(MODE_Ansi)
         self._hold_screen = False
         # Obsolete modes
@@ -965,7 +995,8 @@ class EmuVt102(Emulation):
             self._setScreen(1)
         if m < screen.MODES_SCREEN:
             self._screen[0].setMode(m)
-            self._screen[1].setMode(m)
+            if self._screen[1] is not None:
+                self._screen[1].setMode(m)
             
     def resetMode(self, m):
         self._curr_mode[m] = False
@@ -975,7 +1006,8 @@ class EmuVt102(Emulation):
             self._setScreen(0)
         if m < screen.MODES_SCREEN:
             self._screen[0].resetMode(m)
-            self._screen[1].resetMode(m)
+            if self._screen[1] is not None:
+                self._screen[1].resetMode(m)
             
     def saveMode(self, m):
         self._save_mode[m] = self._curr_mode[m]
@@ -998,9 +1030,41 @@ class EmuVt102(Emulation):
             else:
                 self.resetMode(MODE_Mouse1000)
         
+    def getState(self):
+        state = super(EmuVt102, self).getState()
+        state['modes'] = self._curr_mode
+        state['saved_modes'] = self._save_mode
+        state['charsets'] = [vars(charset) for charset in self._charset]
+        return state
+
+    def setState(self, state):
+        self._curr_mode = dict(state['modes'])
+        self._save_mode = dict(state['saved_modes'])
+        for charset, charset_state in zip(self._charset, state['charsets']):
+            vars(charset).update(charset_state)
+        self._resetToken()
+        super(EmuVt102, self).setState(state)
+
     def _setMargins(self, t, b):
         self._screen[0].setMargins(t, b)
-        self._screen[1].setMargins(t, b)
+        if self._screen[1] is not None:
+            self._alternateScreen().setMargins(t, b)
+
+    def _makeAlternateScreen(self):
+        """return a new alternate screen, with the modes and margins which
+        are shared with the primary screen
+        """
+        alt = super(EmuVt102, self)._makeAlternateScreen()
+        primary = self._screen[0]
+        for m in (screen.MODE_Cursor, screen.MODE_NewLine):
+            if primary.getMode(m):
+                alt.setMode(m)
+            else:
+                alt.resetMode(m)
+        top, bottom = primary.getMargins()
+        if top != 0 or bottom != alt.lines - 1:
+            alt.setMargins(top + 1, bottom + 1)
+        return alt
 
     # private #################################################################
     
@@ -47,6 +47,30 @@ A note on refreshing
    conditions catch, the screen refresh is also triggered by a count
    of incoming bulks (`bulk_incnt').
 
+   While the emulation isn't connected to its widget, received data are
+   only parsed: no refresh is scheduled, the screens recording which lines
+   changed, and the image is cooked once when connected again.
+
+A note on hibernation
+
+   Some time (`HIBERNATE_DELAY' milliseconds by default, see
+   `setHibernateDelay') after a session has been disconnected from its widget
+   and its program stopped writing, its screens and history are packed in a
+   snapshot (see the snapshot module), which is much smaller than their
+   image, and dropped. They are restored transparently as soon as they are
+   needed again: when the session is connected, receives data or is asked for
+   its history. History lines are then only decoded when displayed.
+
+A note on flow control
+
+   When one of the two rules above applies, or when more than
+   `FLOW_HIGH_WATER' bytes have been received since the last refresh, the
+   emulation is considered to be falling behind. It then asks the pty to stop
+   reading (`lockPty' signal) and schedules a refresh for as soon as the
+   pending gui events have been processed. The pty is unlocked once the
+   refresh is done, so that meanwhile the kernel pty buffer throttles the
+   child process instead of data piling up in the event loop.
+
 Based on the konsole code from Lars Doelle.
 
 @author: Lars Doelle
@@ -62,10 +86,13 @@ Based on the konsole code from Lars Doelle.
 
 __revision__ = '$Id: emulation.py,v 1.25 2006-02-15 10:24:01 alf Exp $'
 
+import time
+from cStringIO import StringIO
+
 from pyqonsole.qtwrapper import *
 
-from pyqonsole import Signalable, keytrans
-from pyqonsole.screen import Screen
+from pyqonsole import Signalable, keytrans, snapshot
+from pyqonsole.screen import Screen, MODE_Screen
 
 
 NOTIFYNORMAL = 0
@@ -74,6 +101,16 @@ NOTIFYACTIVITY = 2
 NOTIFYSILENCE = 3
 
 BULK_TIMEOUT = 20
+FLOW_HIGH_WATER = 32768 # bytes received without refresh before locking the pty
+
+PASTE_CHUNK = 4096 # bytes sent to the pty at once when pasting
+PASTE_PROGRESS_MIN = 262144 # larger pastes report their progress to the gui
+
+# milliseconds after which the alternate screen is released once left
+ALTERNATE_RELEASE_DELAY = 60000
+# milliseconds of inactivity after which a disconnected emulation hibernates
+HIBERNATE_DELAY = 300000
+HIBERNATE_INTERVAL = 10000 # milliseconds between inactivity checks
 
 
 class Emulation(Signalable, QObject):
@@ -91,14 +128,33 @@ class Emulation(Signalable, QObject):
     def __init__(self, gui):
         super(Emulation, self).__init__()
         self._gui = gui
-        # 0 = primary, 1 = alternate
-        self._screen = [Screen(self._gui.lines, self._gui.columns),
-                        Screen(self._gui.lines, self._gui.columns)]
+        # 0 = primary, 1 = alternate. The alternate screen is only created
+        # when used (see _alternateScreen) and released some time after the
+        # application left it
+        self._screen = [Screen(self._gui.lines, self._gui.columns), None]
         self._scr = self._screen[0]
+        # size to apply to the alternate screen when switching to it
+        self._alt_size = None
+        self._alt_timer = QTimer(self)
+        self._alt_timer.connect(self._alt_timer, SIGNAL("timeout()"),
+                                self._releaseAlternateScreen)
         # communicate with widget
         self._connected = False
+        # snapshot of the screens while hibernating (see hibernate), and the
+        # size of the history it contains
+        self._hibernated = None
+        self._hibernated_size = None
+        self.hibernate_delay = HIBERNATE_DELAY
+        # output is only recorded here while disconnected, inactivity being
+        # detected by a periodic check of the hibernate timer
+        self._last_output = time.time()
+        self._hibernate_timer = QTimer(self)
+        self._hibernate_timer.connect(self._hibernate_timer,
+                                      SIGNAL("timeout()"),
+                                      self.hibernateTimerDone)
         # codec
         self._codec = None
+        self._codec_no = 0
         self._decoder = None
         # key translator
         self._key_trans = None
@@ -107,8 +163,25 @@ class Emulation(Signalable, QObject):
         self._bulk_timer = QTimer(self)
         self._bulk_nl_cnt = 0 # bulk new line counter
         self._bulk_in_cnt = 0 # bulk counter
+        self._bulk_bytes = 0 # bytes received since the last refresh
+        self._pty_locked = False
         self._bulk_timer.connect(self._bulk_timer, SIGNAL("timeout()"),
                                  self._showBulk)
+        # paste handling
+        self._paste_data = ''
+        self._paste_pos = 0
+        self._paste_timer = QTimer(self)
+        self._paste_timer.connect(self._paste_timer, SIGNAL("timeout()"),
+                                  self._pasteNext)
+        self._send_blocked = False
+        # statistics: number of tokens by class (see emuVt102.TOKEN_CLASSES),
+        # screen refreshes, and time (in seconds) spent parsing received
+        # data, cooking and painting the image
+        self.token_counts = [0] * 16
+        self.refreshes = 0
+        self.parse_time = 0.0
+        self.cook_time = 0.0
+        self.paint_time = 0.0
         gui.myconnect("changedImageSizeSignal", self.onImageSizeChange)
         gui.myconnect("changedHistoryCursor", self.onHistoryCursorChange)
         gui.myconnect("keyPressedSignal", self.onKeyPress)
@@ -118,25 +191,166 @@ class Emulation(Signalable, QObject):
         gui.myconnect("clearSelectionSignal", self.clearSelection)
         gui.myconnect("isBusySelecting", self.isBusySelecting)
         gui.myconnect("testIsSelected", self.testIsSelected)
+        gui.myconnect("pasteSignal", self.onPaste)
+        gui.myconnect("cancelPasteSignal", self.cancelPaste)
         
     def __del__(self):
         self._bulk_timer.stop()
+        self._hibernate_timer.stop()
         
     def _setScreen(self, n):
         """change between primary and alternate screen"""
         old = self._scr
-        self._scr = self._screen[n]
+        if n:
+            self._alt_timer.stop()
+            self._scr = self._alternateScreen()
+        else:
+            self._scr = self._screen[0]
         if not self._scr is old:
             self._scr.clearSelection()
             old.busy_selecting = False
-            
+            if old is self._screen[1]:
+                self._alt_timer.start(ALTERNATE_RELEASE_DELAY, True)
+
+    def _alternateScreen(self):
+        """return the alternate screen, creating it on first use and applying
+        the last size change
+        """
+        alt = self._screen[1]
+        if alt is None:
+            alt = self._screen[1] = self._makeAlternateScreen()
+            self._alt_size = None
+        elif self._alt_size is not None:
+            alt.resizeImage(*self._alt_size)
+            self._alt_size = None
+        return alt
+
+    def _makeAlternateScreen(self):
+        """return a new alternate screen"""
+        primary = self._screen[0]
+        return Screen(primary.lines, primary.columns)
+
+    def _releaseAlternateScreen(self):
+        """drop the alternate screen unless it's in use"""
+        if self._screen[1] is not None and self._scr is not self._screen[1]:
+            self._screen[1] = None
+            self._alt_size = None
+
+    def setHibernateDelay(self, delay):
+        """set the number of milliseconds of inactivity after which the
+        emulation hibernates while disconnected, 0 to never hibernate
+        """
+        self.hibernate_delay = delay
+        self._hibernate_timer.stop()
+        if not self._connected:
+            self._startHibernateTimer()
+
+    def _startHibernateTimer(self):
+        if self.hibernate_delay:
+            self._hibernate_timer.start(min(self.hibernate_delay,
+                                            HIBERNATE_INTERVAL))
+
+    def hibernateTimerDone(self):
+        """periodic check while disconnected: hibernate once nothing has been
+        received for hibernate_delay
+        """
+        if self._hibernated is not None:
+            return
+        if (time.time() - self._last_output) * 1000 >= self.hibernate_delay:
+            self.hibernate()
+
+    def hibernate(self):
+        """pack the screens and their history in a snapshot and drop them,
+        unless connected. They are restored by wakeUp.
+        """
+        if self._connected or self._hibernated is not None:
+            return
+        self._alt_timer.stop()
+        size = self.historySize()
+        stream = StringIO()
+        snapshot.dump(self, stream)
+        self._hibernated = stream.getvalue()
+        self._hibernated_size = size
+        self._screen = [None, None]
+        self._scr = None
+        self._alt_size = None
+
+    def wakeUp(self):
+        """restore the screens packed by hibernate"""
+        if self._hibernated is None:
+            return
+        data = self._hibernated
+        self._hibernated = self._hibernated_size = None
+        snapshot.load(self, data)
+
+    def isHibernating(self):
+        return self._hibernated is not None
+
+    def hibernatedSize(self):
+        """return the size in bytes of the snapshot kept while hibernating"""
+        if self._hibernated is None:
+            return 0
+        return len(self._hibernated)
+
+    def getState(self):
+        """return the state of the emulation and of its screens as a
+        dictionary, see setState and the snapshot module
+        """
+        self.wakeUp()
+        return {'screens': [scr.getState() for scr in self._screen
+                            if scr is not None],
+                'alternate': self._scr is self._screen[1],
+                'codec': self._codec_no}
+
+    def setState(self, state):
+        """restore a state returned by getState. Screens keep their size
+        until the next size change.
+        """
+        screens = []
+        for scr_state in state['screens']:
+            scr = Screen()
+            scr.setState(scr_state)
+            screens.append(scr)
+        self._screen = screens + [None] * (2 - len(screens))
+        self._hibernated = self._hibernated_size = None
+        self._alt_size = None
+        self._alt_timer.stop()
+        if state['alternate']:
+            self._scr = self._screen[1]
+        else:
+            self._scr = self._screen[0]
+            if self._screen[1] is not None:
+                self._alt_timer.start(ALTERNATE_RELEASE_DELAY, True)
+        self._setCodec(state['codec'])
+        # also refreshes the display
+        self.onImageSizeChange(self._gui.lines, self._gui.columns)
+
     def setHistory(self, history_type):
+        self.wakeUp()
         self._screen[0].setScroll(history_type)
         if self._connected:
             self._showBulk()
         
     def history(self):
+        self.wakeUp()
         return self._screen[0].getScroll()
+
+    def setReflow(self, reflow):
+        """set whether wrapped lines of the primary screen and of the history
+        are rewrapped when the number of columns changes
+        """
+        self.wakeUp()
+        self._screen[0].reflow = reflow
+
+    def reflow(self):
+        self.wakeUp()
+        return self._screen[0].reflow
+
+    def historySize(self):
+        """return the number of lines and cells kept in the history"""
+        if self._hibernated is not None:
+            return self._hibernated_size
+        return self._screen[0].getHistLines(), self._screen[0].getHistCells()
     
     def setKeymap(self, no):
         self._key_trans = keytrans.find(no)
@@ -169,16 +383,100 @@ class Emulation(Signalable, QObject):
         """char received from the gui"""
         raise NotImplementedError()
             
+    # Pasting
+    #
+    # Pasted text is sent to the pty by chunks of PASTE_CHUNK bytes. The next
+    # chunk is sent from the event loop, or once the pty has flushed its send
+    # queue if the application doesn't read its input fast enough.
+
+    def onPaste(self, text):
+        """text pasted from the gui"""
+        if not self._connected:
+            return
+        self.myemit("notifySessionState", (NOTIFYNORMAL,))
+        # Revert to non-history when pasting
+        self._scr.hist_cursor = self._scr.getHistLines()
+        data = str(self._codec.fromUnicode(text))
+        start, end = self._pasteBrackets()
+        if end:
+            # pasted text can't end the bracketed paste by itself
+            data = data.replace(end, '')
+        self._paste_data = self._paste_data[self._paste_pos:] + start + data + end
+        self._paste_pos = 0
+        self._pasteNext()
+
+    def cancelPaste(self):
+        """drop the part of pasted text not sent yet"""
+        if self._paste_pos >= len(self._paste_data):
+            return
+        end = self._pasteBrackets()[1]
+        if end and self._paste_pos and self._paste_data.endswith(end):
+            self.sendString(end)
+        self._paste_timer.stop()
+        self._paste_data = ''
+        self._paste_pos = 0
+        self._gui.pasteProgress(0, 0)
+
+    def onSendOverflow(self, size):
+        """data have been dropped since the application doesn't read its
+        input
+        """
+        if self._connected:
+            self._gui.bell()
+
+    def onBufferFull(self):
+        """the pty is queuing data since the application doesn't read them"""
+        self._send_blocked = True
+
+    def onBufferEmpty(self):
+        """the pty has sent all queued data"""
+        self._send_blocked = False
+        if self._paste_pos < len(self._paste_data):
+            self._paste_timer.start(0, True)
+
+    def _pasteBrackets(self):
+        """return strings sent before and after pasted text"""
+        return '', ''
+
+    def _pasteNext(self):
+        """send the next chunk of pasted text, unless the pty is busy"""
+        total = len(self._paste_data)
+        if self._send_blocked or self._paste_pos >= total:
+            return
+        pos = self._paste_pos
+        self._paste_pos = pos + PASTE_CHUNK
+        self.sendString(self._paste_data[pos:self._paste_pos])
+        if total > PASTE_PROGRESS_MIN:
+            self._gui.pasteProgress(min(self._paste_pos, total), total)
+        if self._paste_pos >= total:
+            self._paste_data = ''
+            self._paste_pos = 0
+        elif not self._send_blocked:
+            self._paste_timer.start(0, True)
+
     def onRcvBlock(self, block):
+        self.wakeUp()
         self.myemit("notifySessionState", (NOTIFYACTIVITY,))
-        self._bulkStart()
-        self._bulk_in_cnt += 1
-        for c in block:
-            result = self._decoder.toUnicode(c , 1)
-            for char in result:
-                self.onRcvChar(char.at(0).unicode())
-            if c == '\n':
-                self._bulkNewLine()
+        connected = self._connected
+        if connected:
+            self._bulkStart()
+            self._bulk_in_cnt += 1
+            self._bulk_bytes += len(block)
+        else:
+            self._last_output = time.time()
+        start = time.time()
+        # decode the whole block at once: the decoder keeps the state of
+        # multi-bytes sequences split across blocks
+        onRcvChar = self.onRcvChar
+        for char in unicode(self._decoder.toUnicode(block, len(block))):
+            onRcvChar(ord(char))
+        self.parse_time += time.time() - start
+        if not connected:
+            # parse only, see setConnect
+            return
+        newlines = block.count('\n')
+        if newlines:
+            self._bulkNewLine(newlines)
         self._bulkEnd()
         
     def onSelectionBegin(self, x, y):
@@ -211,12 +509,27 @@ class Emulation(Signalable, QObject):
             self._showBulk()
     
     def setConnect(self, c):
-        self._connected = c
-        if self._connected:
-            self.onImageSizeChange(self._gui.lines, self._gui.columns)
+        """connect the emulation to its widget, or disconnect it. The image is
+        cooked exactly once when connecting, whatever happened meanwhile.
+        """
+        if c:
+            self._hibernate_timer.stop()
+            # before connecting, so that restoring the screens doesn't refresh
+            self.wakeUp()
+            self._connected = True
+            self._resizeScreens(self._gui.lines, self._gui.columns)
             self._showBulk()
+            self.myemit("imageSizeChanged", (self._gui.lines,
+                                              self._gui.columns))
         else:
-            self._scr.clearSelection()
+            self._connected = False
+            # nothing to refresh until connected again
+            self._bulk_timer.stop()
+            self._lockPty(False)
+            if self._hibernated is None:
+                self._scr.clearSelection()
+            self._last_output = time.time()
+            self._startHibernateTimer()
             
     def onImageSizeChange(self, lines, columns):
         """Triggered by image size change of the TEWidget `gui'.
@@ -227,11 +540,18 @@ class Emulation(Signalable, QObject):
         if not self._connected:
             return
         #print 'emulation.onImageSizeChange', lines, columns
-        self._screen[0].resizeImage(lines, columns)
-        self._screen[1].resizeImage(lines, columns)
+        self._resizeScreens(lines, columns)
         self._showBulk()
         # Propagate event to serial line
         self.myemit("imageSizeChanged", (lines, columns))
+
+    def _resizeScreens(self, lines, columns):
+        self._screen[0].resizeImage(lines, columns)
+        if self._scr is self._screen[1]:
+            self._scr.resizeImage(lines, columns)
+        elif self._screen[1] is not None:
+            # resized when switching to it
+            self._alt_size = (lines, columns)
     
     def onHistoryCursorChange(self, cursor):
         if self._connected:
@@ -240,6 +560,7 @@ class Emulation(Signalable, QObject):
         
     def _setCodec(self, c):
         """coded number, 0=locale, 1=utf8"""
+        self._codec_no = c
         if c:
             self._codec = QTextCodec.codecForName("utf8")
         else:
@@ -252,27 +573,45 @@ class Emulation(Signalable, QObject):
         # XXX moreover no one is connected to this signal...
         self.myemit("changeColumns", (columns,))
         
-    def _bulkNewLine(self):
-        self._bulk_nl_cnt += 1
+    def _bulkNewLine(self, count=1):
+        self._bulk_nl_cnt += count
         self._bulk_in_cnt = 0  # Reset bulk counter since 'nl' rule applies
         
     def _showBulk(self):
         self._bulk_nl_cnt = 0
         self._bulk_in_cnt = 0
+        self._bulk_bytes = 0
         if self._connected:
+            start = time.time()
             image, wrapped = self._scr.getCookedImage() # Get the image
+            cooked = time.time()
+            self._gui.setReverseVideo(self._scr.getMode(MODE_Screen))
             self._gui.setImage(image, self._scr.lines, self._scr.columns) #  Actual refresh
+            self.cook_time += cooked - start
+            self.paint_time += time.time() - cooked
+            self.refreshes += 1
             self._gui.setCursorPos(self._scr.getCursorX(), self._scr.getCursorY())
             # FIXME: Check that we do not trigger other draw event here
             self._gui.setLineWrapped(wrapped)
             self._gui.setScroll(self._scr.hist_cursor, self._scr.getHistLines())
+        self._lockPty(False)
             
     def _bulkStart(self):
         if self._bulk_timer.isActive():
             self._bulk_timer.stop()
             
     def _bulkEnd(self):
-        if self._bulk_nl_cnt > self._gui.lines or self._bulk_in_cnt > 20:
-            self._showBulk()
+        if (self._bulk_nl_cnt > self._gui.lines or self._bulk_in_cnt > 20
+            or self._bulk_bytes > FLOW_HIGH_WATER):
+            # falling behind: stop reading until the next refresh, which
+            # happens once pending gui events have been processed
+            self._lockPty(True)
+            self._bulk_timer.start(0, True)
         else:
             self._bulk_timer.start(BULK_TIMEOUT, True)
+
+    def _lockPty(self, lock):
+        """suspend / resume reading from the pty (flow control)"""
+        if lock != self._pty_locked:
+            self._pty_locked = lock
+            self.myemit("lockPty", (lock,))
@@ -1,13 +1,147 @@
 # Copyright (c) 2005-2006 LOGILAB S.A. (Paris, FRANCE).
-# Copyright (c) 2005-2006 CEA Grenoble 
+# Copyright (c) 2005-2006 CEA Grenoble
 # http://www.logilab.fr/ -- mailto:contact@logilab.fr
 #
 # This program is free software; you can redistribute it and/or modify it under
 # the terms of the CECILL license, available at
 # http://www.inria.fr/valorisation/logiciels/Licence.CeCILL-V2.pdf
 #
-"""This module contains all C implemented function.
+"""Character width computation.
+
+Widths of the characters of the basic multilingual plane are read from
+WIDTHS, a table indexed by code point built at import time. Other
+characters are computed by the C implementation from the _helpers
+extension, or by its pure python equivalent when the extension isn't
+built.
+
+See http://www.cl.cam.ac.uk/~mgk25/ucs/wcwidth.c which this comes from.
 """
 __revision__ = '$Id: helpers.py,v 1.4 2006-02-15 10:24:01 alf Exp $'
 
-from pyqonsole._helpers import *
+from array import array
+from bisect import bisect_right
+
+try:
+    from pyqonsole._helpers import wcWidth as _wcWidth
+except ImportError:
+    _wcWidth = None
+
+# sorted list of non-overlapping intervals of non-spacing characters,
+# same as the one in helpers.c
+# generated by "uniset +cat=Me +cat=Mn +cat=Cf -00AD +1160-11FF +200B c"
+COMBINING = (
+    (0x0300, 0x0357), (0x035D, 0x036F), (0x0483, 0x0486),
+    (0x0488, 0x0489), (0x0591, 0x05A1), (0x05A3, 0x05B9),
+    (0x05BB, 0x05BD), (0x05BF, 0x05BF), (0x05C1, 0x05C2),
+    (0x05C4, 0x05C4), (0x0600, 0x0603), (0x0610, 0x0615),
+    (0x064B, 0x0658), (0x0670, 0x0670), (0x06D6, 0x06E4),
+    (0x06E7, 0x06E8), (0x06EA, 0x06ED), (0x070F, 0x070F),
+    (0x0711, 0x0711), (0x0730, 0x074A), (0x07A6, 0x07B0),
+    (0x0901, 0x0902), (0x093C, 0x093C), (0x0941, 0x0948),
+    (0x094D, 0x094D), (0x0951, 0x0954), (0x0962, 0x0963),
+    (0x0981, 0x0981), (0x09BC, 0x09BC), (0x09C1, 0x09C4),
+    (0x09CD, 0x09CD), (0x09E2, 0x09E3), (0x0A01, 0x0A02),
+    (0x0A3C, 0x0A3C), (0x0A41, 0x0A42), (0x0A47, 0x0A48),
+    (0x0A4B, 0x0A4D), (0x0A70, 0x0A71), (0x0A81, 0x0A82),
+    (0x0ABC, 0x0ABC), (0x0AC1, 0x0AC5), (0x0AC7, 0x0AC8),
+    (0x0ACD, 0x0ACD), (0x0AE2, 0x0AE3), (0x0B01, 0x0B01),
+    (0x0B3C, 0x0B3C), (0x0B3F, 0x0B3F), (0x0B41, 0x0B43),
+    (0x0B4D, 0x0B4D), (0x0B56, 0x0B56), (0x0B82, 0x0B82),
+    (0x0BC0, 0x0BC0), (0x0BCD, 0x0BCD), (0x0C3E, 0x0C40),
+    (0x0C46, 0x0C48), (0x0C4A, 0x0C4D), (0x0C55, 0x0C56),
+    (0x0CBC, 0x0CBC), (0x0CBF, 0x0CBF), (0x0CC6, 0x0CC6),
+    (0x0CCC, 0x0CCD), (0x0D41, 0x0D43), (0x0D4D, 0x0D4D),
+    (0x0DCA, 0x0DCA), (0x0DD2, 0x0DD4), (0x0DD6, 0x0DD6),
+    (0x0E31, 0x0E31), (0x0E34, 0x0E3A), (0x0E47, 0x0E4E),
+    (0x0EB1, 0x0EB1), (0x0EB4, 0x0EB9), (0x0EBB, 0x0EBC),
+    (0x0EC8, 0x0ECD), (0x0F18, 0x0F19), (0x0F35, 0x0F35),
+    (0x0F37, 0x0F37), (0x0F39, 0x0F39), (0x0F71, 0x0F7E),
+    (0x0F80, 0x0F84), (0x0F86, 0x0F87), (0x0F90, 0x0F97),
+    (0x0F99, 0x0FBC), (0x0FC6, 0x0FC6), (0x102D, 0x1030),
+    (0x1032, 0x1032), (0x1036, 0x1037), (0x1039, 0x1039),
+    (0x1058, 0x1059), (0x1160, 0x11FF), (0x1712, 0x1714),
+    (0x1732, 0x1734), (0x1752, 0x1753), (0x1772, 0x1773),
+    (0x17B4, 0x17B5), (0x17B7, 0x17BD), (0x17C6, 0x17C6),
+    (0x17C9, 0x17D3), (0x17DD, 0x17DD), (0x180B, 0x180D),
+    (0x18A9, 0x18A9), (0x1920, 0x1922), (0x1927, 0x1928),
+    (0x1932, 0x1932), (0x1939, 0x193B), (0x200B, 0x200F),
+    (0x202A, 0x202E), (0x2060, 0x2063), (0x206A, 0x206F),
+    (0x20D0, 0x20EA), (0x302A, 0x302F), (0x3099, 0x309A),
+    (0xFB1E, 0xFB1E), (0xFE00, 0xFE0F), (0xFE20, 0xFE23),
+    (0xFEFF, 0xFEFF), (0xFFF9, 0xFFFB), (0x1D167, 0x1D169),
+    (0x1D173, 0x1D182), (0x1D185, 0x1D18B), (0x1D1AA, 0x1D1AD),
+    (0xE0001, 0xE0001), (0xE0020, 0xE007F), (0xE0100, 0xE01EF),
+    )
+_COMBINING_FIRSTS = [first for first, last in COMBINING]
+
+# intervals of east asian wide and full width characters
+WIDE = (
+    (0x1100, 0x115F), # Hangul Jamo init. consonants
+    (0x2329, 0x232A),
+    (0x2E80, 0x303E), (0x3040, 0xA4CF), # CJK ... Yi
+    (0xAC00, 0xD7A3), # Hangul Syllables
+    (0xF900, 0xFAFF), # CJK Compatibility Ideographs
+    (0xFE30, 0xFE6F), # CJK Compatibility Forms
+    (0xFF00, 0xFF60), # Fullwidth Forms
+    (0xFFE0, 0xFFE6),
+    (0x20000, 0x2FFFD),
+    (0x30000, 0x3FFFD),
+    )
+
+def _pyWcWidth(ucs):
+    """python implementation of wcWidth"""
+    if ucs == 0:
+        return 0
+    if ucs < 32 or 0x7f <= ucs < 0xa0:
+        return -1
+    i = bisect_right(_COMBINING_FIRSTS, ucs) - 1
+    if i >= 0 and ucs <= COMBINING[i][1]:
+        return 0
+    for first, last in WIDE:
+        if first <= ucs <= last:
+            return 2
+    return 1
+
+if _wcWidth is None:
+    _wcWidth = _pyWcWidth
+
+def _buildTable():
+    """return an array of the widths of the characters of the basic
+    multilingual plane, indexed by code point
+    """
+    table = array('b', [1]) * 0x10000
+    for width, intervals in ((2, WIDE), (0, COMBINING)):
+        for first, last in intervals:
+            if first > 0xffff:
+                break
+            table[first:last+1] = array('b', [width]) * (last + 1 - first)
+    table[0:32] = array('b', [-1]) * 32
+    table[0x7f:0xa0] = array('b', [-1]) * (0xa0 - 0x7f)
+    table[0] = 0
+    return table
+
+WIDTHS = _buildTable()
+
+def wcWidth(ucs):
+    """return the number of columns needed to display the character of the
+    given code point: 0 for the null and combining characters, -1 for
+    control characters, 2 for east asian wide characters, else 1
+    """
+    if ucs < 0x10000:
+        return WIDTHS[ucs]
+    return _wcWidth(ucs)
+
+def wcWidths(text):
+    """return the list of the widths of the characters of the given unicode
+    string
+    """
+    table = WIDTHS
+    widths = []
+    append = widths.append
+    for char in text:
+        ucs = ord(char)
+        if ucs < 0x10000:
+            append(table[ucs])
+        else:
+            append(_wcWidth(ucs))
+    return widths
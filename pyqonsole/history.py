@@ -35,7 +35,40 @@ Based on the konsole code from Lars Doelle.
 """
 
 __revision__ = '$Id: history.py,v 1.10 2006-02-15 10:24:01 alf Exp $'
-    
+
+from pyqonsole.ca import DCA
+
+# minimum number of lines rewrapped at once by HistoryScrollBuffer.reflowFrom
+REFLOW_CHUNK = 500
+
+
+def wrapCells(cells, columns):
+    """split a line into rows of at most `columns` cells, without
+    splitting wide characters, and return the list of rows
+    """
+    rows = []
+    start = 0
+    while len(cells) - start > columns:
+        end = start + columns
+        if cells[end].c is None and end - 1 > start:
+            # don't separate a wide character from its trailing part
+            end -= 1
+        rows.append(cells[start:end])
+        start = end
+    rows.append(cells[start:])
+    return rows
+
+def dropWrapPad(cells, row):
+    """remove the blank cell ending cells, a wrapped row, if it has been left
+    there because row starts with a wide character which didn't fit, so that
+    it doesn't become a space when the rows are joined. Return True if the
+    cell has been removed.
+    """
+    if cells and cells[-1] == DCA and len(row) > 1 and row[1].c is None:
+        del cells[-1]
+        return True
+    return False
+
     
 class HistoryTypeNone(object):
     """History Type which does nothing"""
@@ -78,6 +111,11 @@ class HistoryScrollNone(object):
     def __init__(self, type_=HistoryTypeNone()):
         self.type = type_
         self.lines = 0
+        # number of cells kept in the history
+        self.cells = 0
+        # lines before this one have not been rewrapped since the last call
+        # to reflow
+        self.flowed = 0
         
     def getLineLen(self, lineno):
         """return the size of the given line"""
@@ -94,10 +132,33 @@ class HistoryScrollNone(object):
     def getCells(self, lineno, colno, count=None):
         """return cells of the given line"""
         return None
+
+    def getLine(self, lineno):
+        """return the list of cells of the given line, which must not be
+        modified
+        """
+        return None
+
+    def getStoredLine(self, lineno):
+        """return (store, number of the line in the store) if the given line
+        hasn't been loaded from the store it has been restored from, else
+        None (see HistoryScrollBuffer.restoreLines)
+        """
+        return None
     
     def addCells(self, cells, wrapped=False):
         """add a line to the history with cells a list of Ca()"""
         pass
+
+    def reflow(self, columns):
+        """rewrap the lines at the given width"""
+        pass
+
+    def reflowFrom(self, lineno):
+        """rewrap the lines from the given one if not done yet, see
+        HistoryScrollBuffer.reflowFrom
+        """
+        return None
    
 
 class HistoryScrollBuffer(HistoryScrollNone):
@@ -111,6 +172,12 @@ class HistoryScrollBuffer(HistoryScrollNone):
         self.buff_filled = False
         self.hist_buffer = [None] * max_lines
         self.wrapped_line = [False] * max_lines
+        # lines restored from a store, such as a snapshot, are only loaded
+        # when accessed: until then the buffer holds their number in the
+        # store (see restoreLines)
+        self._store = None
+        # width the lines are being rewrapped to (see reflow)
+        self.reflow_columns = 0
         
     def hasScroll(self):
         """return True if this history is scrollable"""
@@ -118,6 +185,11 @@ class HistoryScrollBuffer(HistoryScrollNone):
     
     def addCells(self, cells, wrapped=False):
         """add a line to the history with cells a list of Ca()"""
+        if self.lines >= self.max_lines - 1:
+            # the first line is dropped, though its slot is only overwritten
+            # by the next line
+            self.cells -= self._lineLen(self.hist_buffer[self._adjustLineNo(0)])
+        self.cells += len(cells)
         self.hist_buffer[self.array_index] = cells
         self.wrapped_line[self.array_index] = wrapped
         self.array_index += 1
@@ -126,6 +198,9 @@ class HistoryScrollBuffer(HistoryScrollNone):
             self.buff_filled = True
         if self.lines < self.max_lines - 1:
             self.lines += 1
+        elif self.flowed:
+            # the first line has been dropped
+            self.flowed -= 1
 
     def getLineLen(self, lineno):
         """return the size of the given line"""
@@ -133,7 +208,7 @@ class HistoryScrollBuffer(HistoryScrollNone):
             return 0
         line = self.hist_buffer[self._adjustLineNo(lineno)]
         if line is not None:
-            return len(line)
+            return self._lineLen(line)
         return 0
 
     def isWrappedLine(self, lineno):
@@ -145,15 +220,141 @@ class HistoryScrollBuffer(HistoryScrollNone):
     def getCells(self, lineno, colno, count=None):
         """return cells of the given line"""
         assert lineno < self.max_lines
-        lineno = self._adjustLineNo(lineno)
-        line = self.hist_buffer[lineno]
+        line = self._load(self._adjustLineNo(lineno))
         assert line is not None
         if count is None:
             count = len(line)
         return line[colno:colno + count]
 
+    def getLine(self, lineno):
+        """return the list of cells of the given line, which must not be
+        modified
+        """
+        assert lineno < self.max_lines
+        line = self._load(self._adjustLineNo(lineno))
+        assert line is not None
+        return line
+
+    def getStoredLine(self, lineno):
+        """return (store, number of the line in the store) if the given line
+        hasn't been loaded from the store it has been restored from, else
+        None
+        """
+        line = self.hist_buffer[self._adjustLineNo(lineno)]
+        if type(line) is int:
+            return self._store, line
+        return None
+
+    def restoreLines(self, store):
+        """replace the lines by the last lines of the given store, which are
+        only loaded when accessed. The store must have a `lines` attribute,
+        `lengths` and `wrapped` sequences giving the number of cells and the
+        wrapped flag of each line, and a getLine(lineno) method.
+        """
+        count = min(store.lines, self.max_lines - 1)
+        first = store.lines - count
+        padding = self.max_lines - count
+        self.hist_buffer = range(first, store.lines) + [None] * padding
+        self.wrapped_line = list(store.wrapped[first:]) + [False] * padding
+        self.lines = self.array_index = count
+        self.buff_filled = False
+        self.flowed = 0
+        self._store = store
+        self.cells = sum(store.lengths[first:])
+
+    def popLine(self):
+        """remove the last line and return its cells"""
+        assert self.lines
+        self._linearize()
+        self.lines -= 1
+        self.array_index = self.lines
+        line = self._load(self.lines)
+        self.hist_buffer[self.lines] = None
+        self.wrapped_line[self.lines] = False
+        self.cells -= len(line)
+        self.flowed = min(self.flowed, self.lines)
+        return line
+
+    def reflow(self, columns):
+        """rewrap the lines at the given width. This is done lazily, from the
+        last lines, as lines are requested through reflowFrom
+        """
+        self.reflow_columns = columns
+        self.flowed = self.lines
+
+    def reflowFrom(self, lineno):
+        """rewrap the lines from the given one, and at least REFLOW_CHUNK
+        lines, if not done yet since the last call to reflow.
+
+        Return None if the lines were already rewrapped, else a tuple
+        (new lineno, end, delta): lines from `end` have been moved by `delta`
+        lines.
+        """
+        flowed = self.flowed
+        if lineno >= flowed:
+            return None
+        self._linearize()
+        buff = self.hist_buffer
+        wrapped = self.wrapped_line
+        # start at the beginning of a wrapped line
+        start = max(0, min(lineno, flowed - REFLOW_CHUNK))
+        while start > 0 and wrapped[start - 1]:
+            start -= 1
+        columns = self.reflow_columns
+        rows = []
+        flags = []
+        cells = []
+        new_lineno = offset = -1
+        for i in xrange(start, flowed):
+            line = self._load(i)
+            if dropWrapPad(cells, line):
+                self.cells -= 1
+            if i == lineno:
+                new_lineno = len(rows)
+                offset = len(cells)
+            cells.extend(line)
+            if wrapped[i] and i < flowed - 1:
+                continue
+            lines = wrapCells(cells, columns)
+            if offset >= 0:
+                # locate the row displaying the first cell of lineno
+                for line in lines[:-1]:
+                    if offset < len(line):
+                        break
+                    offset -= len(line)
+                    new_lineno += 1
+                offset = -1
+            rows += lines
+            flags += [True] * (len(lines) - 1)
+            flags.append(wrapped[i])
+            cells = []
+        buff[start:flowed] = rows
+        wrapped[start:flowed] = flags
+        delta = len(rows) - (flowed - start)
+        self.lines += delta
+        # drop the first lines if there are too many lines now
+        dropped = max(0, self.lines - (self.max_lines - 1))
+        if dropped:
+            for line in buff[:dropped]:
+                self.cells -= self._lineLen(line)
+            del buff[:dropped]
+            del wrapped[:dropped]
+            self.lines -= dropped
+        padding = self.max_lines - len(buff)
+        if padding > 0:
+            buff += [None] * padding
+            wrapped += [False] * padding
+        else:
+            del buff[self.max_lines:]
+            del wrapped[self.max_lines:]
+        self.array_index = self.lines
+        self.flowed = max(0, start - dropped)
+        return (max(0, start + new_lineno - dropped), flowed,
+                delta - dropped)
+
     def setMaxLines(self, max_lines):
         """change the maximum number of lines for the history"""
+        self.reflowFrom(0)
         self._normalize()
         if self.max_lines > max_lines:
             start = max(0, self.array_index + 2 - max_lines)
@@ -168,6 +369,7 @@ class HistoryScrollBuffer(HistoryScrollNone):
         self.max_lines = max_lines
         if self.lines > max_lines - 2:
             self.lines = max_lines - 2
+        self._countCells()
         self.type = HistoryTypeBuffer(max_lines)
 
     def _normalize(self):
@@ -186,10 +388,44 @@ class HistoryScrollBuffer(HistoryScrollNone):
         self.array_index = max_lines - 2
         self.buff_filled = False
         self.lines = max_lines - 2
+        self._countCells()
+
+    def _linearize(self):
+        """store the lines in order from the beginning of the buffer"""
+        if not self.buff_filled:
+            return
+        first = self._adjustLineNo(0)
+        self.hist_buffer = self.hist_buffer[first:] + self.hist_buffer[:first]
+        self.wrapped_line = self.wrapped_line[first:] + self.wrapped_line[:first]
+        # the slot following the last line holds a dropped line
+        self.hist_buffer[self.lines] = None
+        self.array_index = self.lines
+        self.buff_filled = False
+
+    def _countCells(self):
+        """update the number of cells after lines have been dropped"""
+        self.cells = 0
+        for lineno in xrange(self.lines):
+            self.cells += self._lineLen(self.hist_buffer[self._adjustLineNo(lineno)])
+
+    def _load(self, index):
+        """return the line at the given index of the buffer, loading it from
+        the store if necessary
+        """
+        line = self.hist_buffer[index]
+        if type(line) is int:
+            line = self.hist_buffer[index] = self._store.getLine(line)
+        return line
+
+    def _lineLen(self, line):
+        """return the number of cells of a line of the buffer"""
+        if type(line) is int:
+            return self._store.lengths[line]
+        return len(line)
 
     def _adjustLineNo(self, lineno):
         """adjust the given line number according to the buffer state"""
         if self.buff_filled:
-            return (lineno + self.array_index + 2) % self.max_lines
+            return (lineno + self.array_index + 1) % self.max_lines
         else:
             return lineno
@@ -26,7 +26,8 @@ __revision__ = '$Id: keytrans.py,v 1.15 2006-02-15 10:24:01 alf Exp $'
 
 import re
 import sys
-from os.path import basename, dirname, splitext, join, isfile
+import marshal
+from os.path import basename, dirname, splitext, join, isfile, expanduser
 import os
 
 from pyqonsole.qtwrapper import Qt
@@ -78,13 +79,70 @@ CMD_scrollLock       = 12
 CMD_emitClipboard    = 13
 CMD_renameSession    = 14
 
+# parsed keytabs are cached in this file, keyed by path, and invalidated when
+# the keytab file's modification time or size change. Key codes depend on the
+# Qt version, hence the cache version includes it.
+KEYTAB_CACHE_FILE = join(os.environ.get('XDG_CACHE_HOME',
+                                        join(expanduser('~'), '.cache')),
+                         'pyqonsole', 'keytabs')
+KEYTAB_CACHE_VERSION = 1
+
 _KEYMAPS = {}
+_CACHE = None
 
 def loadAll():
     kt = KeyTrans()
     kt.addKeyTrans()
-    # XXX load other keytab files ?
+    # other keytab files are registered, but only parsed once selected
+    keytab_dir = dirname(DEFAULT_KEYTAB_FILE)
+    try:
+        fnames = os.listdir(keytab_dir)
+    except OSError:
+        return
+    fnames.sort()
+    for fname in fnames:
+        if fname.endswith('.keytab') and fname != basename(DEFAULT_KEYTAB_FILE):
+            KeyTrans(join(keytab_dir, fname)).addKeyTrans()
+
+def _cacheVersion():
+    return (KEYTAB_CACHE_VERSION, qtconfig())
+
+def _loadCache():
+    """return the keytabs cache, read from disk on first call"""
+    global _CACHE
+    if _CACHE is None:
+        _CACHE = {}
+        try:
+            stream = open(KEYTAB_CACHE_FILE, 'rb')
+            try:
+                version, cache = marshal.load(stream)
+            finally:
+                stream.close()
+        except (IOError, EOFError, ValueError, TypeError):
+            return _CACHE
+        if version == _cacheVersion():
+            _CACHE = cache
+    return _CACHE
+
+def _saveCache():
+    """write the keytabs cache, errors are silently ignored"""
+    tmpfile = '%s.%s' % (KEYTAB_CACHE_FILE, os.getpid())
+    try:
+        if not os.path.isdir(dirname(KEYTAB_CACHE_FILE)):
+            os.makedirs(dirname(KEYTAB_CACHE_FILE))
+        stream = open(tmpfile, 'wb')
+        try:
+            marshal.dump((_cacheVersion(), _CACHE), stream)
+        finally:
+            stream.close()
+        os.rename(tmpfile, KEYTAB_CACHE_FILE)
+    except (IOError, OSError):
+        try:
+            os.remove(tmpfile)
+        except OSError:
+            pass
     
+
 def find(ktid=0):
     if isinstance(ktid, int):
         try:
@@ -134,6 +192,8 @@ class KeyTrans:
             self.id = splitext(basename(path))[0]
         self._file_read = False
         self._table = []
+        # entries by key, in table order
+        self._index = {}
             
     def addKeyTrans(self):
         """XXX why is this here ??"""
@@ -145,11 +205,24 @@ class KeyTrans:
             return
         self._file_read = True
         if self.path == '[builtin]':
-            buf = open(DEFAULT_KEYTAB_FILE)
+            path = DEFAULT_KEYTAB_FILE
         else: 
-            buf = open(self.path)
+            path = self.path
+        stat = os.stat(path)
+        cached = _loadCache().get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime, stat.st_size):
+            self._hdr = cached[2]
+            for args in cached[3]:
+                self.addEntry(*args)
+            return
+        buf = open(path)
         ktr = KeytabReader(self.path, buf)
         ktr.parseTo(self)
+        buf.close()
+        _CACHE[path] = (stat.st_mtime, stat.st_size, self._hdr,
+                        [(e.ref, e.key, e.bits, e.mask, e.cmd, e.txt)
+                         for e in self._table])
+        _saveCache()
         
     def addEntry(self, ref, key, bits, mask, cmd, txt):
         """returns conflicting entry if any, else create it, add it to the
@@ -160,6 +233,7 @@ class KeyTrans:
         except EntryNotFound:
             entry = KeyEntry(ref, key, bits, mask, cmd, txt)
             self._table.append(entry)
+            self._index.setdefault(key, []).append(entry)
     
     def findEntry(self, key, newline, ansi, appcukeys, control, shift, alt):
         if not self._file_read:
@@ -168,7 +242,7 @@ class KeyTrans:
         return self._findEntry(key, bits)
     
     def _findEntry(self, key, bits, mask=0xffff):
-        for entry in self._table:
+        for entry in self._index.get(key, ()):
             if entry.matches(key, bits, 0xffff):
                 return entry
         raise EntryNotFound('no entry matching %s %s %0x' % (key, bits, mask))
@@ -26,11 +26,6 @@ import os
 import pwd
 
 from pyqonsole import qtconfig
-from pyqonsole.qtwrapper import qt, Qt
-
-from pyqonsole.widget import Widget
-from pyqonsole.session import Session
-from pyqonsole.history import HistoryTypeBuffer
 
 FONTS = [
     "13",
@@ -48,6 +43,7 @@ FONTS = [
 TOPFONT = 0
 
 def setFont(te, fontno):
+    from pyqonsole.qtwrapper import qt
     f = qt.QFont()
     if FONTS[fontno][0] == '-':
         f.setRawName(FONTS[fontno])
@@ -69,7 +65,12 @@ def findExecutablePath(progname):
             return fullname
     raise ValueError('%s not found in PATH' % progname)
 
-def main(argv):
+def main(argv, startup_report=False):
+    # imported here so that their import time may be measured
+    from pyqonsole.qtwrapper import qt, Qt
+    from pyqonsole.widget import Widget
+    from pyqonsole.session import Session
+    from pyqonsole.history import HistoryTypeBuffer
     appli = qt.QApplication(argv)
     te = Widget(appli)
     te.setScrollbarLocation(2)
@@ -92,6 +93,10 @@ def main(argv):
     session = Session(te, progname, args, "xterm");
     session.setConnect(True)
     session.setHistory(HistoryTypeBuffer(1000))
+    session.setReflow(True)
+    if startup_report:
+        from pyqonsole import profiling
+        profiling.watchFirstOutput(session, profiling.startupReport)
     session.run()
     def quit(*args, **kwargs):
         appli.quit()
@@ -103,16 +108,23 @@ def main(argv):
     else:
         appli.exec_()
 
-def profile(argv):
-    from hotshot import Profile
-    prof = Profile('pyqonsole.prof')
-    prof.runcall(main, argv)
-    prof.close()
-    import hotshot.stats
-    stats = hotshot.stats.load('pyqonsole.prof')
-    stats.strip_dirs()
-    stats.sort_stats('time', 'calls')
-    stats.print_stats(30)
+def profile(argv, sampling=False):
+    """run pyqonsole under a profiler which is switched on and off when
+    receiving SIGUSR1, and print statistics of the last profiled window on
+    stderr when the console exits
+    """
+    from pyqonsole import profiling
+    if sampling:
+        profiler = profiling.Sampler()
+    else:
+        profiler = profiling.Profiler()
+    profiler.toggleOnSignal(signal.SIGUSR1)
+    profiler.start()
+    try:
+        main(argv)
+    finally:
+        profiler.stop()
+    profiler.report(sys.stderr, 30)
 
 def showHelp():
     print "pyqonsole --help: displays this message"
@@ -120,16 +132,31 @@ def showHelp():
     print "options:"
     print " --profile : displays profiling statistics when console exits"
     print "             (internal development use. You don't need this)"
+    print "             SIGUSR1 stops and restarts profiling, each profiled"
+    print "             window being written to pyqonsole.prof.<n> (pstats)"
+    print "             and pyqonsole.prof.<n>.callgrind"
+    print " --sample : same as --profile with a low overhead sampling profiler,"
+    print "            writing collapsed stacks to pyqonsole.samples.<n>"
+    print " --startup-report : displays import times and time to the first"
+    print "                    output of the command"
     
 def run(args=None):
     args = args or sys.argv
-    if "--profile" in sys.argv:
-        sys.argv.remove("--profile")
-        profile(sys.argv)
-    elif '--help' in sys.argv or '-h' in sys.argv:
+    if "--profile" in args:
+        args.remove("--profile")
+        profile(args)
+    elif "--sample" in args:
+        args.remove("--sample")
+        profile(args, True)
+    elif '--help' in args or '-h' in args:
         showHelp()
+    elif '--startup-report' in args:
+        args.remove('--startup-report')
+        from pyqonsole import profiling
+        profiling.installImportTimer()
+        main(args, True)
     else:
-        main(sys.argv)
+        main(args)
     
 
 if __name__ == '__main__':
@@ -22,6 +22,12 @@ struct waitdata
   int status
 }
 
+The SIGCHLD handler only reaps the children started by a Process, calling
+waitpid(pid, WNOHANG) on each registered pid, and writes (pid, status)
+records to the pipe. Children started by other means (os.popen, os.system,
+subprocess...) are left to their own waitpid(). Records are dispatched from
+the event loop to the matching Process, found by pid in a dictionary.
+
 Based on the konsole code from Lars Doelle.
 
 @author: Lars Doelle
@@ -43,7 +49,9 @@ import signal
 import struct
 import sys
 
-from pyqonsole.qtwrapper import qt, QObject, SIGNAL, QTimer, QSocketNotifier
+from pyqonsole.qtwrapper import qt, QObject, SIGNAL, QSocketNotifier
+
+RECORD_SIZE = struct.calcsize('II')
 
 def waitChildren():
     """wait for all children process, yield (pid, status) each time one
@@ -57,6 +65,8 @@ def waitChildren():
             else:
                 yield answ
         except OSError, ex:
+            if ex.errno == errno.EINTR:
+                continue
             if ex.errno == errno.ECHILD:
                 break
             raise
@@ -78,15 +88,13 @@ class ProcessController(QObject):
         self.old_sigCHLDHandler = None
         self.handler_set = False
         self.process_list = []
+        # started processes by pid
+        self._processes = {}
         self.fd = os.pipe()
-        # delayed children cleanup timer
-        self._dcc_timer = QTimer()
         fcntl.fcntl(self.fd[0], fcntl.F_SETFL, os.O_NONBLOCK)
         notifier = QSocketNotifier(self.fd[0], QSocketNotifier.Read, self)
         self.connect(notifier, SIGNAL('activated(int)'),
                      self.slotDoHousekeeping)
-        self.connect(self._dcc_timer, SIGNAL('timeout()'),
-                                self.delayedChildrenCleanup)
         theProcessController = self
         self.setupHandlers()
 
@@ -137,8 +145,36 @@ class ProcessController(QObject):
         #sigaddset( &newset, SIGCHLD )
         #sigprocmask( SIG_BLOCK, &newset, &oldset )
         self.process_list.remove(process)
+        if self._processes.get(process.pid) is process:
+            del self._processes[process.pid]
         #sigprocmask( SIG_SETMASK, &oldset, 0 )
 
+    def processStarted(self, process):
+        """register the pid of a forked process, so that its exit is
+        dispatched to it
+        """
+        self._processes[process.pid] = process
+        # the child may have exited before being registered
+        self._reap(process.pid)
+
+    def _reap(self, pid):
+        """reap the given child if it exited, writing its status to the
+        pipe. Return True if it did.
+        """
+        while True:
+            try:
+                wpid, status = os.waitpid(pid, os.WNOHANG)
+            except OSError, ex:
+                if ex.errno == errno.EINTR:
+                    continue
+                # already reaped, its exit is waiting in the pipe
+                return False
+            break
+        if wpid > 0:
+            os.write(self.fd[1], struct.pack('II', wpid, status))
+            return True
+        return False
+
 
     def sigCHLDHandler(self, sig, frame):
         """SIGCHLD handler
@@ -154,71 +190,45 @@ class ProcessController(QObject):
         to make sure that no SIGCHLDs where missed.
         """
         found = False
-        # iterating the list doesn't perform any system call
-        for process in self.process_list:
-            if process.pid is None:
-                continue
-            if not process.running:
-                continue
-            try:
-                wpid, status = os.waitpid(process.pid, os.WNOHANG)
-            except OSError:
-                # [Errno 10] No child processes
-                # XXX: bug in process.py ?
-                continue
-            if wpid > 0:
-                os.write(self.fd[1], struct.pack('II', wpid, status))
+        for pid in self._processes.keys():
+            if self._reap(pid):
                 found = True
         if (not found and
-            not self.old_sigCHLDHandler in (signal.SIG_IGN, signal.SIG_DFL)):
-            self.old_sigCHLDHandler(sig) # call the old handler
-        # handle the rest
-        # XXX
-        os.write(self.fd[1], struct.pack('II', 0, 0)) # delayed waitpid()
+            not self.old_sigCHLDHandler in (None, signal.SIG_IGN, signal.SIG_DFL)):
+            # the child is not ours
+            self.old_sigCHLDHandler(sig, frame) # call the old handler
 
     def slotDoHousekeeping(self, _):
         """NOTE: It can happen that QSocketNotifier fires while
         we have already read from the socket. Deal with it.
         
-        read pid and status from the pipe.
+        read pids and status from the pipe and dispatch them to the exited
+        processes
         """
-        bytes_read = ''
-        while not bytes_read:
+        while True:
             try:
-                bytes_read = os.read(self.fd[0], struct.calcsize('II'))
+                bytes_read = os.read(self.fd[0], RECORD_SIZE * 64)
             except OSError, ex:
-                if ex.errno == errno.EAGAIN:
-                    return
                 if ex.errno == errno.EINTR:
+                    continue
+                if ex.errno != errno.EAGAIN:
                     msg = ("Error: pipe read returned errno=%d "
                            "in ProcessController::slotDoHousekeeping")
                     print >> sys.stderr, msg % ex.errno
-                    return
-        if len(bytes_read) != struct.calcsize('II'):
+                return
+            break
+        # records are smaller than PIPE_BUF, so they are written and read
+        # atomically
+        if len(bytes_read) % RECORD_SIZE:
             msg = "Error: Could not read info from signal handler %d <> %d!"
-            print >> sys.stderr, msg % (len(bytes_read), struct.calcsize('II'))
-            return
-        pid, status = struct.unpack('II', bytes_read)
-        if pid == 0:
-            self._dcc_timer.start(100, True)
+            print >> sys.stderr, msg % (len(bytes_read), RECORD_SIZE)
             return
-        for process in self.process_list:
-            if process.pid == pid:
+        for offset in xrange(0, len(bytes_read), RECORD_SIZE):
+            pid, status = struct.unpack('II',
+                                        bytes_read[offset:offset+RECORD_SIZE])
+            process = self._processes.pop(pid, None)
+            if process is not None and process.pid == pid:
                 process.processHasExited(status)
-                return
-
-    def delayedChildrenCleanup(self):
-        """this is needed e.g. for popen(), which calls waitpid() checking
-        // for its forked child, if we did waitpid() directly in the SIGCHLD
-        // handler, popen()'s waitpid() call would fail
-        """
-        for wpid, status in waitChildren():
-            for process in self.process_list:
-                if not process.running or process.pid != wpid:
-                    continue
-                # it's Process, handle it
-                os.write(self.fd[1], struct.pack('II', wpid, status))
-                break
 
     def waitForProcessExit(self, timeout):
         """
@@ -228,16 +238,14 @@ class ProcessController(QObject):
         *
         * return True if a process exited, False if no process exited within
           @p timeout seconds.
-        // Due to a race condition the signal handler may have
-        // failed to detect that a pid belonged to a Process
-        // and defered handling to delayedChildrenCleanup()
-        // Make sure to handle that first.
         """
-        if self._dcc_timer.isActive():
-            self._dcc_timer.stop()
-            self.delayedChildrenCleanup()
         while True:
-            rlist, wlist, xlist  = select.select([self.fd[0]], [], [], timeout)
+            try:
+                rlist = select.select([self.fd[0]], [], [], timeout)[0]
+            except select.error, ex:
+                if ex.args[0] == errno.EINTR:
+                    continue # SIGCHLD
+                raise
             if not rlist:
                 return False
             else:
@@ -0,0 +1,333 @@
+# Copyright (c) 2005-2007 LOGILAB S.A. (Paris, FRANCE).
+# Copyright (c) 2005-2006 CEA Grenoble
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the CECILL license, available at
+# http://www.inria.fr/valorisation/logiciels/Licence.CeCILL-V2.pdf
+#
+"""Profiling utilities.
+
+Startup time measurement: time spent importing each module and time
+until the first output of the client program (usually its prompt).
+Use `pyqonsole --startup-report` to get the report on stderr, or from an
+embedding application:
+
+>>> from pyqonsole import profiling
+>>> profiling.installImportTimer()
+>>> # import pyqonsole's modules, create a session...
+>>> profiling.watchFirstOutput(session)
+
+Profilers which may be switched on and off while running, for instance on
+SIGUSR1 (`pyqonsole --profile` and `pyqonsole --sample`), to only profile a
+window of activity:
+
+* Profiler is a deterministic profiler writing pstats and callgrind files
+* Sampler is a low overhead statistical profiler writing collapsed stacks,
+  suitable for production sessions
+
+@author: Sylvain Thenault
+@copyright: 2007
+@organization: Logilab
+@license: CECILL
+"""
+
+import os
+import sys
+import time
+import signal
+import __builtin__
+from os.path import basename
+
+START_TIME = time.time()
+
+# module name -> [inclusive time, own time]
+_IMPORT_TIMES = {}
+# time spent in the imports being executed, excluding the current one
+_STACK = []
+_ORIG_IMPORT = None
+_FIRST_OUTPUT = None
+
+
+def _timedImport(name, *args):
+    if name in sys.modules:
+        # "from package import module": time the submodules not loaded yet
+        fromlist = args[2:3] and args[2]
+        if fromlist:
+            package = sys.modules[name]
+            for item in fromlist:
+                if item != '*' and not hasattr(package, item):
+                    try:
+                        _timedImport('%s.%s' % (name, item))
+                    except ImportError:
+                        pass
+        return _ORIG_IMPORT(name, *args)
+    _STACK.append(0.0)
+    start = time.time()
+    try:
+        return _ORIG_IMPORT(name, *args)
+    finally:
+        elapsed = time.time() - start
+        children = _STACK.pop()
+        if _STACK:
+            _STACK[-1] += elapsed
+        times = _IMPORT_TIMES.setdefault(name, [0.0, 0.0])
+        times[0] += elapsed
+        times[1] += elapsed - children
+
+def installImportTimer():
+    """start measuring the time spent in each import"""
+    global _ORIG_IMPORT
+    if _ORIG_IMPORT is None:
+        _ORIG_IMPORT = __builtin__.__import__
+        __builtin__.__import__ = _timedImport
+
+def uninstallImportTimer():
+    """stop measuring imports"""
+    global _ORIG_IMPORT
+    if _ORIG_IMPORT is not None:
+        __builtin__.__import__ = _ORIG_IMPORT
+        _ORIG_IMPORT = None
+
+def importTimes():
+    """return a list of (own time, inclusive time, module name) sorted by
+    decreasing own time
+    """
+    result = [(own, incl, name)
+              for name, (incl, own) in _IMPORT_TIMES.items()]
+    result.sort()
+    result.reverse()
+    return result
+
+def watchFirstOutput(session, callback=None):
+    """record the time when the session's program first outputs something,
+    then call the optional callback
+    """
+    def firstOutput(block):
+        global _FIRST_OUTPUT
+        if _FIRST_OUTPUT is None:
+            _FIRST_OUTPUT = time.time() - START_TIME
+            if callback is not None:
+                callback()
+    session.sh.myconnect('block_in', firstOutput)
+
+def startupReport(stream=None, limit=20):
+    """write the startup report to stream (default to stderr)"""
+    stream = stream or sys.stderr
+    times = importTimes()
+    total = 0.0
+    for own, incl, name in times:
+        total += own
+    print >> stream, 'imports: %.1fms in %d modules' % (total * 1000,
+                                                         len(times))
+    print >> stream, '%10s %10s  module' % ('own (ms)', 'incl (ms)')
+    for own, incl, name in times[:limit]:
+        print >> stream, '%10.2f %10.2f  %s' % (own * 1000, incl * 1000, name)
+    if _FIRST_OUTPUT is None:
+        print >> stream, 'no output received from the client program'
+    else:
+        print >> stream, 'time to first output: %.1fms' % (_FIRST_OUTPUT * 1000)
+
+
+# Runtime profilers ###########################################################
+
+class _Switch(object):
+    """base class for profilers which may be started and stopped
+    repeatedly, each window of activity being written to
+    <filename>.<window number>
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.windows = 0
+        self.running = False
+
+    def _path(self):
+        return '%s.%d' % (self.filename, self.windows)
+
+    def start(self):
+        raise NotImplementedError()
+
+    def stop(self):
+        raise NotImplementedError()
+
+    def toggle(self, *args):
+        """start the profiler if stopped, else stop it. May be used as a
+        signal handler.
+        """
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def toggleOnSignal(self, signo=signal.SIGUSR1):
+        """switch the profiler on and off when receiving the given signal"""
+        signal.signal(signo, self.toggle)
+
+
+class Profiler(_Switch):
+    """deterministic profiler (cProfile, or hotshot before python 2.5).
+    Each window is written as pstats data, and as <file>.callgrind for
+    kcachegrind.
+    """
+
+    def __init__(self, filename='pyqonsole.prof'):
+        super(Profiler, self).__init__(filename)
+        self._profile = None
+        self.stats = None
+
+    def start(self):
+        if self.running:
+            return
+        self.windows += 1
+        try:
+            import cProfile
+        except ImportError:
+            import hotshot
+            self._profile = hotshot.Profile(self._path() + '.hotshot')
+            self._profile.start()
+        else:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        self.running = True
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        path = self._path()
+        if hasattr(self._profile, 'enable'):
+            import pstats
+            self._profile.disable()
+            self._profile.dump_stats(path)
+            self.stats = pstats.Stats(path)
+        else:
+            import hotshot.stats
+            self._profile.stop()
+            self._profile.close()
+            self.stats = hotshot.stats.load(path + '.hotshot')
+            self.stats.dump_stats(path)
+            os.remove(path + '.hotshot')
+        self._profile = None
+        stream = open(path + '.callgrind', 'w')
+        try:
+            writeCallgrind(self.stats, stream)
+        finally:
+            stream.close()
+        print >> sys.stderr, 'profile written to %s' % path
+
+    def report(self, stream=None, limit=30):
+        """write statistics of the last window to stream (default to stderr)
+        """
+        if self.stats is not None:
+            self.stats.stream = stream or sys.stderr
+            self.stats.strip_dirs()
+            self.stats.sort_stats('time', 'calls')
+            self.stats.print_stats(limit)
+
+
+def writeCallgrind(stats, stream):
+    """write pstats statistics in the callgrind format, costs being in
+    microseconds
+    """
+    calls = {}
+    for callee, (cc, nc, tt, ct, callers) in stats.stats.items():
+        for caller, info in callers.items():
+            if isinstance(info, tuple):
+                count, cost = info[1], info[3]
+            else: # old profilers only give the number of calls
+                count, cost = info, ct * info / max(nc, 1)
+            calls.setdefault(caller, []).append((callee, count, cost))
+    print >> stream, 'events: Microseconds'
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        filename, lineno, name = func
+        print >> stream
+        print >> stream, 'fl=%s' % filename
+        print >> stream, 'fn=%s:%s' % (name, lineno)
+        print >> stream, '%d %d' % (lineno, tt * 1000000)
+        for callee, count, cost in calls.get(func, ()):
+            print >> stream, 'cfl=%s' % callee[0]
+            print >> stream, 'cfn=%s:%s' % (callee[2], callee[1])
+            print >> stream, 'calls=%d %d' % (count, callee[1])
+            print >> stream, '%d %d' % (lineno, cost * 1000000)
+
+
+class Sampler(_Switch):
+    """statistical profiler recording the python stack each `interval`
+    seconds of CPU time (requires signal.setitimer, ie python >= 2.6).
+    Samples are written as collapsed stacks, one "f1;f2;f3 count" line per
+    distinct stack, as expected by flame graph tools.
+    """
+
+    def __init__(self, filename='pyqonsole.samples', interval=0.005):
+        super(Sampler, self).__init__(filename)
+        self.interval = interval
+        self._stacks = {}
+        self._old_handler = None
+
+    def start(self):
+        if self.running:
+            return
+        if not hasattr(signal, 'setitimer'):
+            raise RuntimeError('sampling requires python >= 2.6')
+        self.windows += 1
+        self._stacks = {}
+        self._old_handler = signal.signal(signal.SIGPROF, self._sample)
+        # don't let samples interrupt system calls
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        self.running = True
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._old_handler or signal.SIG_DFL)
+        path = self._path()
+        stream = open(path, 'w')
+        try:
+            for stack, count in self._stacks.items():
+                print >> stream, '%s %d' % (';'.join([_codeName(code)
+                                                      for code in stack]),
+                                            count)
+        finally:
+            stream.close()
+        print >> sys.stderr, 'samples written to %s' % path
+
+    def _sample(self, signo, frame):
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        stack.reverse()
+        stack = tuple(stack)
+        self._stacks[stack] = self._stacks.get(stack, 0) + 1
+
+    def report(self, stream=None, limit=30):
+        """write functions of the last window to stream (default to stderr)
+        by number of samples where they are running (own) or on the stack
+        (incl)
+        """
+        stream = stream or sys.stderr
+        own = {}
+        incl = {}
+        total = 0
+        for stack, count in self._stacks.items():
+            total += count
+            own[stack[-1]] = own.get(stack[-1], 0) + count
+            for code in dict.fromkeys(stack):
+                incl[code] = incl.get(code, 0) + count
+        result = [(count, incl[code], code) for code, count in own.items()]
+        result.sort()
+        result.reverse()
+        print >> stream, '%d samples' % total
+        print >> stream, '%10s %10s  function' % ('own', 'incl')
+        for count, incl_count, code in result[:limit]:
+            print >> stream, '%10d %10d  %s' % (count, incl_count,
+                                                _codeName(code))
+
+def _codeName(code):
+    return '%s (%s:%d)' % (code.co_name, basename(code.co_filename),
+                           code.co_firstlineno)
+
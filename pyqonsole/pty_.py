@@ -42,26 +42,92 @@ import select
 import signal
 import stat
 import sys
+import time
+from collections import deque
 from pty import openpty
 from struct import pack
-from fcntl import ioctl, fcntl, F_SETFL
+from fcntl import ioctl, fcntl, F_SETFL, F_SETFD, FD_CLOEXEC
 from resource import getrlimit, RLIMIT_NOFILE
 from termios import tcgetattr, tcsetattr, VINTR, VQUIT, VERASE, \
      TIOCSPGRP, TCSANOW, TIOCSWINSZ, TIOCSCTTY
 
-from pyqonsole.qtwrapper import QObject, QSocketNotifier, SIGNAL, QTimer
+from pyqonsole.qtwrapper import QObject, QSocketNotifier, QTimer, SIGNAL
 
 from pyqonsole import CTRL, Signalable, procctrl
 
+# size of pty reads: the read size starts at READ_SIZE, doubles each time a
+# read fills it, up to MAX_READ_SIZE, and shrinks back on short reads
+READ_SIZE = 4096
+MAX_READ_SIZE = 262144
+# time budget (in seconds) for draining the pty on a single notification
+READ_TIME_BUDGET = 0.02
 
-class Job:
-    def __init__(self, string):
-        self.start = 0
-        self.string = string
-        self.length = len(string)
+# maximum number of bytes queued while the child doesn't read its input, and
+# what to do with a string which doesn't fit in: drop it whole (the default, a
+# "sendOverflow" signal is emitted) or block until the child has read enough.
+# A string is never cut: once partly written, its remainder is always queued.
+SEND_QUEUE_MAX = 1048576
+OVERFLOW_DROP = 0
+OVERFLOW_BLOCK = 1
+
+# directories listing the open file descriptors of the current process
+FD_DIRS = ('/proc/self/fd', '/dev/fd')
+
+
+def _openFds():
+    """return the list of open file descriptors, or None if they can't be
+    listed
+    """
+    for fd_dir in FD_DIRS:
+        try:
+            return [int(fd) for fd in os.listdir(fd_dir)]
+        except (OSError, ValueError):
+            continue
+    return None
+
+def _closeRange(low, high):
+    """close file descriptors from low (included) to high (excluded)"""
+    if hasattr(os, 'closerange'):
+        os.closerange(low, high)
+        return
+    for fd in xrange(low, high):
+        try:
+            os.close(fd)
+        except OSError:
+            continue
+
+def closeFds(keep):
+    """close every file descriptor except those in keep. Only open
+    descriptors are closed when they can be listed, instead of trying each
+    one up to the RLIMIT_NOFILE limit.
+    """
+    fds = _openFds()
+    if fds is not None:
+        for fd in fds:
+            if not fd in keep:
+                try:
+                    os.close(fd)
+                except OSError:
+                    # the descriptor used to list the directory
+                    continue
+        return
+    low = 0
+    for fd in sorted(keep) + [getrlimit(RLIMIT_NOFILE)[0]]:
+        _closeRange(low, fd)
+        low = fd + 1
+
+def resetSignals():
+    """reset signal handlers to their default, skipping those known to
+    be already
+    """
+    for i in xrange(1, signal.NSIG):
+        if signal.getsignal(i) == signal.SIG_DFL:
+            continue
+        try:
+            signal.signal(i, signal.SIG_DFL)
+        except (RuntimeError, ValueError):
+            continue
 
-    def finished(self):
-        return self.start == len(self.string)
 
     
 class PtyProcess(Signalable, QObject):
@@ -99,13 +165,24 @@ class PtyProcess(Signalable, QObject):
         self.out = [-1, -1]
         # the socket notifiers for the above socket descriptors
         self._outnot = None
+        # write notifier for the master side, enabled while data is queued
+        self._innot = None
         procctrl.theProcessController.addProcess(self)        
         self.wsize = (0, 0)
         self.addutmp = False
         self.term = None
         self.openPty()
-        self._pending_send_jobs = []
-        self._pending_send_job_timer = None
+        # strings waiting for the child to read its input, the first one
+        # being partially sent up to _send_offset
+        self._send_queue = deque()
+        self._send_offset = 0
+        self._send_queued = 0
+        self.send_overflow = OVERFLOW_DROP
+        self._read_size = READ_SIZE
+        # statistics
+        self.bytes_read = 0
+        self.blocks_read = 0
+        self.bytes_written = 0
         self.myconnect('receivedStdout', self.dataReceived)
         self.myconnect('processExited',  self.donePty)
         
@@ -169,57 +246,132 @@ class PtyProcess(Signalable, QObject):
         
     def sendBytes(self, string):
         """sends len bytes through the line"""
-        if self._pending_send_jobs:
-            self.appendSendJob(string)
-        else:
-            written = 0
-            while written < len(string):
-                try:
-                    written += os.write(self.master_fd, string[written:])
-                except OSError, ex:
-                    if ex.errno in (errno.EAGAIN, errno.EINTR):
-                        self.appendSendJob(string)
-                    return
+        if self.send_overflow == OVERFLOW_DROP and \
+               self._send_queued + len(string) > SEND_QUEUE_MAX:
+            self.myemit('sendOverflow', (len(string),))
+            return
+        if self._send_queue:
+            self._queueSend(string)
+            return
+        written = self._writeSome(string)
+        if written < len(string):
+            self._queueSend(string[written:])
 
-    def appendSendJob(self, string):
-        """"""
-        self._pending_send_jobs.append(Job(string))
-        if not self._pending_send_job_timer:
-            self._pending_send_job_timer = QTimer()
-            self._pending_send_job_timer.connect(self._pending_send_job_timer,
-                                                 SIGNAL('timeout()'),
-                                                 self.doSendJobs)
-        self._pending_send_job_timer.start(0)
-
-    def doSendJobs(self):
-        """qt slot"""
-        while self._pending_send_jobs:
-            job = self._pending_send_jobs[0]
-            job.start += os.write(self.master_fd, job.string[job.start:])
-            #if ( errno!=EAGAIN and errno!=EINTR )
-            #   self._pending_send_jobs.remove(self._pending_send_jobs.begin())
-            #   return
-            if job.finished():
-                self._pending_send_jobs.remove(job)
-        if self._pending_send_job_timer:
-            self._pending_send_job_timer.stop()
+    def sendQueueSize(self):
+        """return the number of bytes waiting for the child to read them"""
+        return self._send_queued
+
+    def _writeSome(self, string, offset=0):
+        """write as much as possible of string from offset without blocking,
+        return the number of bytes consumed
+        """
+        start = offset
+        while offset < len(string):
+            try:
+                offset += os.write(self.master_fd, buffer(string, offset))
+            except OSError, ex:
+                if ex.errno == errno.EINTR:
+                    continue
+                if ex.errno != errno.EAGAIN:
+                    # the line is broken, forget about the data
+                    return len(string) - start
+                break
+        self.bytes_written += offset - start
+        return offset - start
+
+    def _queueSend(self, string):
+        """queue string until the pty is writable again. The "bufferFull"
+        signal is emitted when the queue starts to fill, and "bufferEmpty"
+        once it is flushed.
+        """
+        if not self._send_queue:
+            self.myemit('bufferFull')
+        self._send_queue.append(string)
+        self._send_queued += len(string)
+        if self._innot is None:
+            self._innot = QSocketNotifier(self.master_fd,
+                                          QSocketNotifier.Write, self)
+            self.connect(self._innot, SIGNAL('activated(int)'),
+                         self.doSendJobs)
+        self._innot.setEnabled(True)
+        if self.send_overflow == OVERFLOW_BLOCK:
+            self._waitSendQueue()
+
+    def _waitSendQueue(self):
+        """block until the send queue is back under SEND_QUEUE_MAX bytes"""
+        while self._send_queued > SEND_QUEUE_MAX:
+            select.select([], [self.master_fd], [])
+            self.doSendJobs()
+
+    def doSendJobs(self, fd=None):
+        """qt slot: the pty is writable, send as much of the queue as
+        possible, the queued strings being written in place
+        """
+        queue = self._send_queue
+        while queue:
+            head = queue[0]
+            written = self._writeSome(head, self._send_offset)
+            self._send_offset += written
+            self._send_queued -= written
+            if self._send_offset < len(head):
+                # would block
+                break
+            queue.popleft()
+            self._send_offset = 0
+        if not queue and self._innot is not None and self._innot.isEnabled():
+            self._innot.setEnabled(False)
+            self.myemit('bufferEmpty')
 
     def dataReceived(self, fd, lenlist):
-        """qt slot: indicates that a block of data is received """
-        try:
-            buf = os.read(fd, 4096)
-        except OSError:
-            #
-            import traceback
-            traceback.print_exc()
-            return
-        lenlist[0] = len(buf)
-        if not buf:
+        """qt slot: indicates that a block of data is received
+
+        The pty is drained until the read would block or READ_TIME_BUDGET is
+        exhausted, and everything read is emitted as a single block.
+        """
+        chunks = []
+        total = 0
+        eof = False
+        size = self._read_size
+        deadline = time.time() + READ_TIME_BUDGET
+        while True:
+            try:
+                buf = os.read(fd, size)
+            except OSError, ex:
+                if ex.errno == errno.EINTR:
+                    continue
+                if not chunks and ex.errno != errno.EAGAIN:
+                    #
+                    import traceback
+                    traceback.print_exc()
+                    return
+                break
+            if not buf:
+                eof = True # reported on the next read if we got data
+                break
+            chunks.append(buf)
+            total += len(buf)
+            if len(buf) == size:
+                size = min(size * 2, MAX_READ_SIZE)
+            else:
+                size = max(size // 2, READ_SIZE)
+            if time.time() > deadline:
+                break
+        self._read_size = size
+        if not chunks:
+            if eof:
+                lenlist[0] = 0
             return
+        lenlist[0] = total
+        self.bytes_read += total
+        self.blocks_read += 1
+        if len(chunks) == 1:
+            block = chunks[0]
+        else:
+            block = ''.join(chunks)
 ##         f = open("pty.log", "a")
-##         f.write(buf)
+##         f.write(block)
 ##         f.close()
-        self.myemit('block_in', (buf,))
+        self.myemit('block_in', (block,))
               
     def donePty(self):
         """qt slot"""
@@ -251,8 +403,16 @@ class PtyProcess(Signalable, QObject):
         had been specified in the call to start().
         """
         self._outnot = None
+        self._clearSendQueue()
         os.close(self.out[0])
 
+    def _clearSendQueue(self):
+        """forget about data not sent yet, the line is being closed"""
+        self._innot = None
+        self._send_queue = deque()
+        self._send_offset = 0
+        self._send_queued = 0
+
     def normalExit(self):
         """return True if the process has already finished and has exited
         "voluntarily", ie: it has not been killed by a signal.
@@ -325,6 +485,7 @@ class PtyProcess(Signalable, QObject):
         # go back to the usual mechanism.
         fcntl(self.out[0], F_SETFL, os.O_NONBLOCK)
         self._outnot = None
+        self._clearSendQueue()
         while True:
             # * If the process is still running we block until we
             # receive data. (p_timeout = 0, no timeout)
@@ -402,24 +563,17 @@ class PtyProcess(Signalable, QObject):
         os.setuid(uid)
         tt = self.slave_fd
         # reset signal handlers for child process
-        for i in range(1, signal.NSIG):
-            try:
-                signal.signal(i, signal.SIG_DFL)
-            except RuntimeError, ex:
-                #print 'error resetting signal handler for sig %d: %s' % (i, ex)
-                continue
+        resetSignals()
         # Don't know why, but his is vital for SIGHUP to find the child.
         # Could be, we get rid of the controling terminal by this.
-        soft = getrlimit(RLIMIT_NOFILE)[0]
-        # We need to close all remaining fd's.
-        # Especially the one used by Process.start to see if we are running ok.
-        for i in range(soft):
-            # FIXME: (result of merge) Check if (not) closing fd is OK)
-            if i != tt:# and i != self.master_fd):
-                try:
-                    os.close(i)
-                except OSError:
-                    continue
+        # We need to close all remaining fd's but the one used by
+        # Process.start to see if we are running ok, which is closed by exec.
+        # FIXME: (result of merge) Check if (not) closing fd is OK)
+        keep = [tt]
+        if fd[1]:
+            keep.append(fd[1])
+            fcntl(fd[1], F_SETFD, FD_CLOEXEC)
+        closeFds(keep)
         os.dup2(tt, sys.stdin.fileno())
         os.dup2(tt, sys.stdout.fileno())
         os.dup2(tt, sys.stderr.fileno())
@@ -453,17 +607,28 @@ class PtyProcess(Signalable, QObject):
             os.environ['TERM'] = self.term
         ioctl(0, TIOCSWINSZ, pack('4H', self.wsize[0], self.wsize[1], 0, 0))
         # finally, pass to the new program
-        os.execvp(arguments[0], arguments)
-        sys.exit(1) # control should never come here.
+        try:
+            os.execvp(arguments[0], arguments)
+        except OSError:
+            # tell the parent we failed to start
+            if fd[1]:
+                os.write(fd[1], chr(1))
+        os._exit(1) # control should never come here.
         
     def _parentStart(self, fd):
         """parent process part of the start method"""
+        procctrl.theProcessController.processStarted(self)
         if fd[1]:
             os.close(fd[1])
         # Check whether client could be started.
         if fd[0]:
             while True:
-                bytes = os.read(fd[0], 1)
+                try:
+                    bytes = os.read(fd[0], 1)
+                except OSError, ex:
+                    if ex.errno == errno.EINTR:
+                        continue # SIGCHLD
+                    raise
                 if not bytes:
                     break # success
                 if ord(bytes) == 1:
@@ -497,9 +662,75 @@ class PtyProcess(Signalable, QObject):
         if self._outnot:
             self._outnot.setEnabled(True)
 
+    def lockPty(self, lock):
+        """qt slot: suspend or resume reading from the pty, letting the
+        kernel pty buffer throttle the child process while the emulation
+        catches up
+        """
+        if lock:
+            self.suspend()
+        else:
+            self.resume()
+
     def slotChildOutput(self, fdno):
         """This slot gets activated when data from the child's stdout arrives.
         It usually calls "childOutput"
         """
         if not self.childOutput(fdno):
             self.closeStdout()
+
+
+class PtyPool(object):
+    """a pool of idle programs (usually shells) started in advance on spare
+    ptys, so that a new session can adopt one instead of forking the
+    application when it's opened.
+
+    Idle processes don't have their output read until adopted, so the
+    shell's prompt is displayed by the session adopting it. The pool is
+    refilled from the event loop after each adoption.
+    """
+
+    def __init__(self, pgm, args, term, size=2):
+        self.pgm = pgm
+        self.args = args
+        self.term = term
+        self.size = size
+        self.idle = []
+        self._filling = False
+
+    def fill(self):
+        """start processes until the pool is full"""
+        self._filling = False
+        self.idle = [process for process in self.idle if process.running]
+        while len(self.idle) < self.size:
+            process = PtyProcess()
+            process.term = self.term
+            process.addutmp = True
+            process.start([self.pgm] + self.args)
+            if not process.running:
+                break # couldn't start the program
+            self.idle.append(process)
+
+    def take(self, pgm, args, term):
+        """return an idle process running pgm with args and term, or None"""
+        if (pgm, args, term) != (self.pgm, self.args, self.term):
+            return None
+        process = None
+        while self.idle:
+            candidate = self.idle.pop(0)
+            if candidate.running:
+                process = candidate
+                break
+        if not self._filling:
+            self._filling = True
+            QTimer.singleShot(0, self.fill)
+        return process
+
+    def close(self):
+        """hang up idle processes"""
+        for process in self.idle:
+            if process.running:
+                process.kill(signal.SIGHUP)
+        self.idle = []
+        self.size = 0
+
@@ -10,7 +10,6 @@ if qtconfig() == 3:
     AltButton = Qt.AltButton
 
 elif qtconfig() == 4:
-    print "using Qt4"
     from PyQt4 import QtGui as qt
     from PyQt4.QtCore import QObject, SIGNAL, QSocketNotifier, QTimer, QTextCodec, QEvent, Qt, QRegExp, QString, QRect, QSize, QPoint
     ControlButton = Qt.ControlModifier
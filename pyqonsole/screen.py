@@ -41,8 +41,8 @@ Based on the konsole code from Lars Doelle.
 __revision__ = "$Id: screen.py,v 1.32 2006-02-15 10:24:01 alf Exp $"
 
 from pyqonsole.ca import *
-from pyqonsole.helpers import wcWidth
-from pyqonsole.history import HistoryScrollBuffer
+from pyqonsole.helpers import wcWidth, WIDTHS
+from pyqonsole.history import HistoryScrollBuffer, wrapCells, dropWrapPad
 
 MODE_Origin  = 0
 MODE_Wrap    = 1
@@ -71,9 +71,17 @@ class Screen(object):
         self.columns = c
         self._image = [[DCA for _ in xrange(c)] for _ in xrange(l+1)]
         self._line_wrapped = [False for _ in xrange(l+1)]
+        # rows of the image modified since the last getCookedImage call
+        self._dirty = [True] * (l+1)
+        # rows returned by the last getCookedImage call, and the state they
+        # have been computed from (see getCookedImage)
+        self._cooked = [None] * l
+        self._cooked_keys = [None] * l
         # History buffer
         self.hist_cursor = 0
         self._hist = HistoryScrollBuffer(1000)
+        # rewrap wrapped lines when the number of columns changes
+        self.reflow = False
         # Cursor location
         self._cu_x = 0
         self._cu_y = 0
@@ -191,6 +199,10 @@ class Screen(object):
         else:
             self._cu_y = 0
     
+    def getMargins(self):
+        """return the (top, bottom) margins, starting from 0"""
+        return self._margin_t, self._margin_b
+
     # Cursor movement with scrolling
     def newLine(self):
         """
@@ -244,6 +256,7 @@ class Screen(object):
         if (BS_CLEARS):
             oldca = self._image[self._cu_y][self._cu_x]
             self._image[self._cu_y][self._cu_x] = Ca(u' ', oldca.f, oldca.b, oldca.r)
+            self._dirty[self._cu_y] = True
         
     def clear(self):
         """Clear the entire screen and home the cursor"""
@@ -412,7 +425,10 @@ class Screen(object):
 
     def showCharacter(self, c):
         #print 'screen.showcharacter', chr(c)
-        w = wcWidth(c)
+        if c < 0x10000:
+            w = WIDTHS[c]
+        else:
+            w = wcWidth(c)
         if w <= 0:
             return
         if self._cu_x+w > self.columns:
@@ -421,36 +437,44 @@ class Screen(object):
                 self.nextLine()
             else:
                 self._cu_x = self.columns-w
-        if self.getMode(MODE_Insert):
+        if self._curr_mode[MODE_Insert]:
             self.insertChars(w)
-        cpt = [self._cu_y, self._cu_x]
-        self.checkSelection(cpt, cpt)
-        line = self._image[self._cu_y]
-        line[self._cu_x] = Ca(unichr(c), self._eff_fg, self._eff_bg,
-                              self._eff_re)
-        self._cu_x += w
-        for i in xrange(1, w):
-            line[self._cu_x + i] = Ca(None, self._eff_fg, self._eff_bg,
-                                      self._eff_re)
+        y = self._cu_y
+        x = self._cu_x
+        if self._sel_begin[0] != -1: # there is a selection
+            self.checkSelection([y, x], [y, x])
+        line = self._image[y]
+        self._dirty[y] = True
+        line[x] = Ca(unichr(c), self._eff_fg, self._eff_bg, self._eff_re)
+        if w > 1:
+            # trailing part of a wide character
+            line[x + 1] = Ca(None, self._eff_fg, self._eff_bg, self._eff_re)
+        self._cu_x = x + w
         
     def resizeImage(self, lines, columns):
         if lines == self.lines and columns == self.columns:
             return
-        if self._cu_y > lines+1:
-            self._margin_b = self.lines-1
-            for i in xrange(self._cu_y - (lines-1)):
-                self._addHistoryLine()
-                self._scrollUp(self._margin_t, 1)
-        # Make new image
-        newimg = [[DCA for x in xrange(columns)] for y in xrange(lines+1)]
-        newwrapped = [False for y in xrange(lines+1)]
-        # Copy to new image
-        for y in xrange(min(lines, self.lines)):
-            for x in xrange(min(columns, self.columns)):
-                newimg[y][x] = self._image[y][x]
-            newwrapped[y] = self._line_wrapped[y]
-        self._image = newimg
-        self._line_wrapped = newwrapped
+        if self.reflow and columns != self.columns:
+            self._reflowImage(lines, columns)
+        else:
+            if self._cu_y > lines+1:
+                self._margin_b = self.lines-1
+                for i in xrange(self._cu_y - (lines-1)):
+                    self._addHistoryLine()
+                    self._scrollUp(self._margin_t, 1)
+            # Make new image
+            newimg = [[DCA for x in xrange(columns)] for y in xrange(lines+1)]
+            newwrapped = [False for y in xrange(lines+1)]
+            # Copy to new image
+            for y in xrange(min(lines, self.lines)):
+                for x in xrange(min(columns, self.columns)):
+                    newimg[y][x] = self._image[y][x]
+                newwrapped[y] = self._line_wrapped[y]
+            self._image = newimg
+            self._line_wrapped = newwrapped
+        self._dirty = [True] * (lines+1)
+        self._cooked = [None] * lines
+        self._cooked_keys = [None] * lines
         self.lines = lines
         self.columns = columns
         self._cu_x = min(self._cu_x, self.columns-1)
@@ -459,48 +483,199 @@ class Screen(object):
         self._margin_b = self.lines - 1
         self.__initTabStops()
         self.clearSelection()
+
+    def _reflowImage(self, lines, columns):
+        """make a new image of the given size, wrapped lines being rewrapped
+        at the new width and lines which don't fit anymore being added to the
+        history. The history itself is rewrapped lazily, as its lines get
+        displayed (see _reflowHistory).
+        """
+        hist = self._hist
+        at_bottom = self.hist_cursor == hist.lines
+        # the first line may be the end of a line wrapped in the history
+        popped = []
+        while hist.lines and hist.isWrappedLine(hist.lines - 1):
+            popped.append(hist.popLine())
+        popped.reverse()
+        cells = []
+        for line in popped:
+            dropWrapPad(cells, line)
+            cells += line
+        self.hist_cursor = min(self.hist_cursor, hist.lines)
+        hist.reflow(columns)
+        # keep lines up to the cursor or to the last non blank line
+        last = self._cu_y
+        for y in xrange(self.lines-1, last, -1):
+            if [ca for ca in self._image[y] if ca != DCA]:
+                last = y
+                break
+        rows = []
+        flags = []
+        cursor = None
+        for y in xrange(last+1):
+            line = self._image[y][:self.columns]
+            dropWrapPad(cells, line)
+            if y == self._cu_y:
+                cursor = [len(rows), len(cells) + self._cu_x]
+            if self._line_wrapped[y] and y < last:
+                cells += line
+                continue
+            if not self._line_wrapped[y]:
+                end = len(line)
+                while end > 0 and line[end-1] == DCA:
+                    end -= 1
+                line = line[:end]
+            cells += line
+            if cursor is not None and cursor[0] == len(rows):
+                # the cursor may be after the end of the line
+                cells += [DCA] * (cursor[1] - len(cells))
+                wrapped_rows = wrapCells(cells, columns)
+                for row in wrapped_rows[:-1]:
+                    if cursor[1] < len(row):
+                        break
+                    cursor[1] -= len(row)
+                    cursor[0] += 1
+            else:
+                wrapped_rows = wrapCells(cells, columns)
+            rows += wrapped_rows
+            flags += [True] * (len(wrapped_rows) - 1)
+            flags.append(self._line_wrapped[y])
+            cells = []
+        # scroll lines into the history so that the cursor stays visible,
+        # but not beyond the cursor: lines below it which don't fit are lost
+        excess = max(0, min(len(rows) - lines, cursor[0]),
+                     cursor[0] - lines + 1)
+        for i in xrange(excess):
+            hist.addCells(rows[i], flags[i])
+        rows = rows[excess:excess+lines]
+        flags = flags[excess:excess+lines]
+        self._image = [row + [DCA] * (columns - len(row)) for row in rows]
+        self._image += [[DCA] * columns for y in xrange(lines + 1 - len(rows))]
+        self._line_wrapped = flags + [False] * (lines + 1 - len(rows))
+        self._cu_y = cursor[0] - excess
+        self._cu_x = min(cursor[1], columns-1)
+        if at_bottom:
+            self.hist_cursor = hist.lines
+
+    def _reflowHistory(self):
+        """rewrap the history lines displayed from hist_cursor, if they
+        haven't been since the last resize
+        """
+        result = self._hist.reflowFrom(self.hist_cursor)
+        if result is not None:
+            self.hist_cursor = result[0]
+            # line numbers changed
+            self.clearSelection()
         
     def getCookedImage(self):
+        """return the (image, wrapped) to display: the visible part of the
+        history and screen with the selection and cursor applied. The screen
+        mode (reverse video) is left to the display.
+
+        Rows are only rebuilt when they changed since the previous call,
+        other rows being the very same lists as in the previously returned
+        image. Returned rows must therefore not be modified.
+        """
         #print 'cooked image', self.lines, self._hist.lines, self.hist_cursor
-        image = [[DCA for x in xrange(self.columns)] for y in xrange(self.lines)]
-        wrapped = [False for i in xrange(self.lines)]
         hist = self._hist
+        if self.hist_cursor < hist.flowed:
+            self._reflowHistory()
+        image = self._cooked
+        keys = self._cooked_keys
+        dirty = self._dirty
+        wrapped = [False] * self.lines
         actual_y = hist.lines - self.hist_cursor
-        # get lines from history
-        for y in xrange(min(self.lines, actual_y)):
-            yq = y + self.hist_cursor
-            len_ = min(self.columns, hist.getLineLen(yq))
-            image[y][:len_] = hist.getCells(yq, 0, len_)
-            for x in xrange(self.columns):
-                q = [yq, x]
-                if q >= self._sel_topleft and q <= self._sel_bottomright:
-                    self._reverseRendition(image, x, y)
-            wrapped[y] = self._hist.isWrappedLine(y+self.hist_cursor)
-        # get lines from the actual screen
-        for y in xrange(actual_y, self.lines):
+        cuy = -1
+        if self.getMode(MODE_Cursor) and self._cu_x < self.columns:
+            cuy = self._cu_y + actual_y
+        for y in xrange(self.lines):
             yq = y + self.hist_cursor
-            yr = y - actual_y
-            for x in xrange(self.columns):
-                q = [yq, x]
-                image[y][x] = self._image[yr][x]
-                if q >= self._sel_topleft and q <= self._sel_bottomright:
-                    self._reverseRendition(image, x, y)
-            wrapped[y] = self._line_wrapped[y-actual_y]
-        # reverse rendition on screen mode
-        if self.getMode(MODE_Screen):
-            for y in xrange(self.lines):
-                for x in xrange(self.columns):
-                    self._reverseRendition(image, x, y)
+            if y < actual_y:
+                # get line from history, those lines are never modified
+                source = hist.getLine(yq)
+                changed = False
+                wrapped[y] = hist.isWrappedLine(yq)
+            else:
+                # get line from the actual screen
+                yr = y - actual_y
+                source = self._image[yr]
+                changed = dirty[yr]
+                wrapped[y] = self._line_wrapped[yr]
+            sel = self._selectedRange(yq)
+            if y == cuy:
+                cux = self._cu_x
+            else:
+                cux = -1
+            key = keys[y]
+            if (changed or key is None or key[0] is not source or
+                key[1] != sel or key[2] != cux):
+                keys[y] = (source, sel, cux)
+                image[y] = self._cookLine(source, sel, cux)
+        self._dirty = [False] * (self.lines+1)
+        return image[:], wrapped
+
+    def _cookLine(self, source, sel, cux):
+        """return a new displayed line from the given history or screen
+        line, sel being its selected range
+        """
+        line = source[:self.columns]
+        if len(line) < self.columns:
+            line += [DCA] * (self.columns - len(line))
+        if sel is not None:
+            first, last = sel
+            line[first:last+1] = [reversedCa(ca) for ca in line[first:last+1]]
         # update cursor
-        cuy = self._cu_y + actual_y
-        if self.getMode(MODE_Cursor) and \
-               cuy < self.lines and self._cu_x < self.columns:
-            ca = image[cuy][self._cu_x]
-            image[cuy][self._cu_x] = Ca(ca.c, ca.f, ca.b, ca.r | RE_CURSOR)
-        return image, wrapped
-        
+        if cux >= 0:
+            ca = line[cux]
+            line[cux] = Ca(ca.c, ca.f, ca.b, ca.r | RE_CURSOR)
+        return line
+        
+    def getState(self):
+        """return the state of the screen as a dictionary, see setState and
+        the snapshot module. The selection isn't part of it.
+        """
+        return {'lines': self.lines, 'columns': self.columns,
+                'image': self._image, 'wrapped': self._line_wrapped,
+                'history': self._hist, 'hist_cursor': self.hist_cursor,
+                'reflow': self.reflow,
+                'cursor': (self._cu_x, self._cu_y, self._cu_fg, self._cu_bg,
+                           self._cu_re),
+                'saved_cursor': (self.__saCuX, self.__saCuY, self.__saCuFg,
+                                 self.__saCuBg, self.__saCuRe),
+                'margins': (self._margin_t, self._margin_b),
+                'modes': self._curr_mode, 'saved_modes': self._save_mode,
+                'tab_stops': self.__tabStops}
+
+    def setState(self, state):
+        """restore a state returned by getState. Its image and history are
+        used as is.
+        """
+        self.lines = state['lines']
+        self.columns = state['columns']
+        self._image = state['image']
+        self._line_wrapped = state['wrapped']
+        self._hist = state['history']
+        self.hist_cursor = state['hist_cursor']
+        self.reflow = state['reflow']
+        (self._cu_x, self._cu_y, self._cu_fg, self._cu_bg,
+         self._cu_re) = state['cursor']
+        (self.__saCuX, self.__saCuY, self.__saCuFg, self.__saCuBg,
+         self.__saCuRe) = state['saved_cursor']
+        self._margin_t, self._margin_b = state['margins']
+        self._curr_mode = list(state['modes'])
+        self._save_mode = list(state['saved_modes'])
+        self.__tabStops = list(state['tab_stops'])
+        self._effectiveRendition()
+        self._dirty = [True] * (self.lines+1)
+        self._cooked = [None] * self.lines
+        self._cooked_keys = [None] * self.lines
+        self.clearSelection()
+
     def getHistLines(self):
         return self._hist.lines
+
+    def getHistCells(self):
+        return self._hist.cells
     
     def setScroll(self, scroll_type):
         self.clearSelection()
@@ -522,6 +697,7 @@ class Screen(object):
             for x in xrange(loca[1], loce[1]+1):
                 self._image[y][x] = ca
             self._line_wrapped[y] = False
+            self._dirty[y] = True
     
     def _moveImage(self, dest, loca, loce):
         #print 'move image', dest, loca, loce
@@ -537,6 +713,7 @@ class Screen(object):
             xs = loca[1]
             dx = loce[1] - xs + 1
             self._image[ys][dest[1]:dest[1]+dx] = self._image[ys][xs:xs+dx]
+            self._dirty[ys] = True
         # Adjust selection to follow scroll
         if self._sel_begin != [-1, -1]:
             beginIsSTL = (self._sel_begin == self._sel_topleft)
@@ -640,10 +817,6 @@ class Screen(object):
             else:
                 self._eff_fg -= BASE_COLORS
                 
-    def _reverseRendition(self, image, x, y):
-#        image[coord] = p = image[coord].dump()
-        p = image[y][x]
-        image[y][x] = Ca(p.c, p.b, p.f, p.r)
 
     # selection handling ######################################################
 
@@ -671,84 +844,66 @@ class Screen(object):
         pos = [y+self.hist_cursor, x]
         return pos >= self._sel_topleft and pos <= self._sel_bottomright
     
+    def _selectedRange(self, yq):
+        """return the (first, last) selected columns of the line yq
+        (history coordinates), or None if it has no selected cell
+        """
+        if not self._sel_topleft[0] <= yq <= self._sel_bottomright[0]:
+            return None
+        first = 0
+        last = self.columns - 1
+        if yq == self._sel_topleft[0]:
+            first = self._sel_topleft[1]
+        if yq == self._sel_bottomright[0]:
+            last = min(last, self._sel_bottomright[1])
+        if first > last:
+            return None
+        return first, last
+
     def clearSelection(self):
         self._sel_begin = [-1, -1]      # First location selected
         self._sel_topleft = [-1, -1]    # Top-left location
         self._sel_bottomright = [-1, -1]# Bottom-right location
         
     def getSelText(self, preserve_line_break):
+        """return the selected text, or None if there is no selection. Lines
+        are separated by a new line if preserve_line_break is true, else by
+        a space
+        """
         if self._sel_begin == [-1, -1]:
-            return
-        histBR = [self._hist.lines, 0]
-        hY = self._sel_topleft[0]
-        hX = self._sel_topleft[1]
-        m = []
-        s = self._sel_topleft[:]
+            return None
         if preserve_line_break:
-            eol_char = '\n'
-        else:
-            eol_char = ' '
-        while s <= self._sel_bottomright:
-            # XXX in the first if branch, eol is scalar while in the else branch, it's a point !
-            if s < histBR:
-                eol = self._hist.getLineLen(hY)
-                if hY == self._sel_bottomright[0] and eol > self._sel_bottomright[1]:
-                    eol = self._sel_bottomright[1] + 1
-                while hX < eol:
-                    c = self._hist.getCells(hY, hX, 1)[0].c
-                    if c is not None:
-                        m.append(c)
-                    self._incPoint(s)
-                    hX += 1
-                if s <= self._sel_bottomright:
-                    if eol % self.columns == 0:
-                        if eol == 0:
-                            m.append(eol_char)
-                        elif not self._hist.isWrappedLine(hY):
-                            m.append(eol_char)
-                    elif (eol + 1) % self.columns == 0:
-                        if not self._hist.isWrappedLine(hY):
-                            m.append(eol_char)
-                    else:
-                        m.append(eol_char)
-                hY += 1
-                hX = 0
-                s = [hY, 0]
+            return u'\n'.join(list(self.iterSelLines()))
+        return u' '.join(list(self.iterSelLines())).rstrip()
+
+    def iterSelLines(self):
+        """yield the text of each line of the selection, wrapped lines being
+        joined and trailing spaces removed
+        """
+        if self._sel_begin == [-1, -1]:
+            return
+        hist = self._hist
+        hist_lines = hist.lines
+        top, first = self._sel_topleft
+        bottom, last = self._sel_bottomright
+        parts = []
+        for yq in xrange(top, bottom + 1):
+            if yq < hist_lines:
+                cells = hist.getLine(yq)
+                wrapped = hist.isWrappedLine(yq)
             else:
-                eol = [s[0]+1, 0]
-                self._incPoint(eol, -1)
-                addNewLine = False
-                if eol < self._sel_bottomright:
-                    while eol > s:
-                        pt = self._subPoints(eol, histBR)
-                        ca = self._image[pt[0]][pt[1]]
-                        if (not ca.c or ca.isSpace()) and not self._line_wrapped[pt[0]]:
-                            break
-                        self._incPoint(eol, -1)
-                elif eol == self._sel_bottomright:
-                    pt = self._subPoints(eol, histBR)
-                    if not self._line_wrapped[pt[0]]:
-                        addNewLine = True
-                else:
-                    eol = self._sel_bottomright
-                while s <= eol:
-                    pt = self._subPoints(s, histBR)
-                    c = self._image[pt[0]][pt[1]].c
-                    if c is not None:
-                        m.append(c)
-                    self._incPoint(s)
-                if eol < self._sel_bottomright:
-                    if eol[1] +1 == self.columns: #(eol + 1) % self.columns == 0:
-                        if not self._hist.isWrappedLine(eol[0]-histBR[0]):
-                            m.append(eol_char)
-                    else:
-                        m.append(eol_char)
-                elif addNewLine and preserve_line_break:
-                    m.append('\n')
-                s = [eol[0]+1, 0]
-        # skip trailing spaces
-        m = [line.rstrip() for line in ''.join(m).splitlines()]
-        return '\n'.join(m)
+                cells = self._image[yq - hist_lines]
+                wrapped = self._line_wrapped[yq - hist_lines]
+            if yq == bottom:
+                cells = cells[:last + 1]
+                wrapped = False
+            if yq == top:
+                cells = cells[first:]
+            # None are the trailing parts of wide characters
+            parts.append(u''.join([ca.c for ca in cells if ca.c is not None]))
+            if not wrapped:
+                yield u''.join(parts).rstrip()
+                parts = []
     
     def checkSelection(self, from_, to):
         if self._sel_begin == [-1, -1]:
@@ -24,10 +24,11 @@ Based on the konsole code from Lars Doelle.
 """
 
 import os
+import time
 
 from pyqonsole.qtwrapper import qt, QObject, SIGNAL, QTimer
 
-from pyqonsole import Signalable, pty_, emulation, emuVt102
+from pyqonsole import Signalable, pty_, emulation, emuVt102, snapshot
 
 
 
@@ -36,11 +37,19 @@ class Session(Signalable, QObject):
     """
 
     SILENCE_TIMEOUT = 10000 # milliseconds
+    MONITOR_INTERVAL = 1000 # milliseconds between silence checks
+    METRICS_TIMEOUT = 1000 # milliseconds between metrics overlay updates
     
-    def __init__(self, gui, pgm, args, term, sessionid='session-1', cwd=None):
+    def __init__(self, gui, pgm, args, term, sessionid='session-1', cwd=None,
+                 pool=None):
         super(Session, self).__init__()
         self.monitor_activity = False
         self._monitor_silence = False # see the property below
+        # activity is only recorded here, silence being detected by a
+        # periodic check of the monitor timer. States are emitted on changes
+        # only, see notifySessionState
+        self._last_activity = time.time()
+        self._state = emulation.NOTIFYNORMAL
         self.master_mode = False
         # FIXME: using the indices here is propably very bad. We should use a
         # persistent reference instead.
@@ -58,17 +67,28 @@ class Session(Signalable, QObject):
         self.term = term
         self.session_id = sessionid
         self.cwd = cwd
-        self.sh = pty_.PtyProcess()
+        # adopt an already running process from the pool if possible
+        self.sh = None
+        if pool is not None and cwd is None:
+            self.sh = pool.take(pgm, args, term)
+        if self.sh is None:
+            self.sh = pty_.PtyProcess()
         self.em = emuVt102.EmuVt102(self.te)
         self.monitor_timer = QTimer(self)
         self.sh.setSize(self.te.lines, self.te.columns)
         self.sh.myconnect('block_in', self.em.onRcvBlock)
         self.sh.myconnect('done', self.done)
+        self.sh.myconnect('bufferFull', self.em.onBufferFull)
+        self.sh.myconnect('bufferEmpty', self.em.onBufferEmpty)
+        self.sh.myconnect('sendOverflow', self.em.onSendOverflow)
         self.em.myconnect('imageSizeChanged', self.sh.setSize)
         self.em.myconnect('sndBlock', self.sh.sendBytes)
+        self.em.myconnect('lockPty', self.sh.lockPty)
         self.em.myconnect('changeTitle', self.setUserTitle)
         self.em.myconnect('notifySessionState', self.notifySessionState)
         self.connect(self.monitor_timer, SIGNAL('timeout()'), self.monitorTimerDone)
+        self.metrics_timer = QTimer(self)
+        self.connect(self.metrics_timer, SIGNAL('timeout()'), self.showMetrics)
 
     def __del__(self):
         self.sh.mydisconnect('done', self.done)
@@ -78,7 +98,11 @@ class Session(Signalable, QObject):
             return
         self._monitor_silence = monitor
         if monitor:
-            self.monitor_timer.start(self.SILENCE_TIMEOUT, True)
+            self._last_activity = time.time()
+            if self._state == emulation.NOTIFYSILENCE:
+                self._state = emulation.NOTIFYNORMAL
+            self.monitor_timer.start(min(self.SILENCE_TIMEOUT,
+                                         self.MONITOR_INTERVAL))
         else:
             self.monitor_timer.stop()
     def getMonitorSilence(self):
@@ -86,16 +110,73 @@ class Session(Signalable, QObject):
     monitor_silence = property(getMonitorSilence, setMonitorSilence)
     
     def run(self):
-        cwd_save = os.getcwd()
-        if self.cwd:
-            os.chdir(self.cwd)
-        self.sh.run(self.pgm, self.args, self.term, True)
-        if self.cwd:
-            os.chdir(cwd_save)
+        if self.sh.running:
+            # adopted from a pool
+            self.sh.resume()
+        else:
+            cwd_save = os.getcwd()
+            if self.cwd:
+                os.chdir(self.cwd)
+            self.sh.run(self.pgm, self.args, self.term, True)
+            if self.cwd:
+                os.chdir(cwd_save)
         # We are reachable via kwrited XXX not needed by pyqonsole ?            
         self.sh.setWriteable(False)
 
 
+    def metrics(self):
+        """return a dictionary of performance counters of this session"""
+        em = self.em
+        tokens = {}
+        for name, classes in emuVt102.TOKEN_CLASSES.items():
+            tokens[name] = 0
+            for i in classes:
+                tokens[name] += em.token_counts[i]
+        history_lines, history_cells = em.historySize()
+        return {'bytes_read': self.sh.bytes_read,
+                'blocks_read': self.sh.blocks_read,
+                'bytes_written': self.sh.bytes_written,
+                'send_queue': self.sh.sendQueueSize(),
+                'tokens': tokens,
+                'refreshes': em.refreshes,
+                'parse_time': em.parse_time,
+                'cook_time': em.cook_time,
+                'paint_time': em.paint_time,
+                'history_lines': history_lines,
+                'history_cells': history_cells,
+                'hibernated': em.hibernatedSize(),
+                }
+
+    def metricsText(self):
+        """return performance counters as a list of lines"""
+        m = self.metrics()
+        tokens = m['tokens']
+        return [
+            'read %(bytes_read)d bytes in %(blocks_read)d blocks' % m,
+            'written %(bytes_written)d bytes, %(send_queue)d queued' % m,
+            'tokens: %s' % ' '.join(['%s %d' % (name, tokens[name])
+                                     for name in ('CHR', 'CTL', 'ESC',
+                                                  'CSI', 'VT52')]),
+            'refreshes %d, parse %.0fms, cook %.0fms, paint %.0fms' % (
+                m['refreshes'], m['parse_time'] * 1000,
+                m['cook_time'] * 1000, m['paint_time'] * 1000),
+            'history %(history_lines)d lines, %(history_cells)d cells' % m,
+            ]
+
+    def setMetricsOverlay(self, enabled):
+        """display performance counters over the terminal, updated every
+        METRICS_TIMEOUT milliseconds
+        """
+        if enabled:
+            self.showMetrics()
+            self.metrics_timer.start(self.METRICS_TIMEOUT)
+        else:
+            self.metrics_timer.stop()
+            self.te.setOverlay(None)
+
+    def showMetrics(self):
+        self.te.setOverlay(self.metricsText())
+
     def setUserTitle(self, what, caption):
         """
         what=0 changes title and icon
@@ -120,16 +201,29 @@ class Session(Signalable, QObject):
         return False
 
     def monitorTimerDone(self):
-        self.myemit('notifySessionState', (emulation.NOTIFYSILENCE,))
-        self.monitor_timer.start(self.SILENCE_TIMEOUT, True)
+        """periodic check: notify silence once there has been no activity
+        for SILENCE_TIMEOUT
+        """
+        if self._state == emulation.NOTIFYSILENCE:
+            return
+        if (time.time() - self._last_activity) * 1000 >= self.SILENCE_TIMEOUT:
+            self._state = emulation.NOTIFYSILENCE
+            self.myemit('notifySessionState', (emulation.NOTIFYSILENCE,))
 
     def notifySessionState(self, state):
+        """state notified by the emulation. Activity is notified for each
+        block received, so it's only forwarded when entering the active state
+        (the first activity after a keystroke, bell or silence)
+        """
         if state == emulation.NOTIFYACTIVITY:
-            if self.monitor_silence:
-                self.monitor_timer.stop()
-                self.monitor_timer.start(self.SILENCE_TIMEOUT, True)
+            self._last_activity = time.time()
+            if self._state == state:
+                return
             if not self.monitor_activity:
+                # leave the silent state without notifying
+                self._state = emulation.NOTIFYNORMAL
                 return
+        self._state = state
         self.myemit('notifySessionState', (state,))
 
     def done(self, status):
@@ -156,3 +250,28 @@ class Session(Signalable, QObject):
 
     def history(self):
         return self.em.history()
+
+    def saveSnapshot(self, filename):
+        """write the screens and history to the given file, see the snapshot
+        module
+        """
+        snapshot.save(self.em, filename)
+
+    def restoreSnapshot(self, filename):
+        """restore the screens and history from a file written by
+        saveSnapshot
+        """
+        snapshot.restore(self.em, filename)
+
+    def setReflow(self, reflow):
+        self.em.setReflow(reflow)
+
+    def reflow(self):
+        return self.em.reflow()
+
+    def setHibernateDelay(self, delay):
+        """set the number of milliseconds after which the screens and history
+        are packed to save memory while the session isn't displayed, 0 to
+        disable it
+        """
+        self.em.setHibernateDelay(delay)
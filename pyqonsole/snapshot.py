@@ -0,0 +1,285 @@
+# Copyright (c) 2005-2007 LOGILAB S.A. (Paris, FRANCE).
+# Copyright (c) 2005-2006 CEA Grenoble
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the CECILL license, available at
+# http://www.inria.fr/valorisation/logiciels/Licence.CeCILL-V2.pdf
+#
+"""Binary snapshots of an emulation: its screens, with their cursor, modes,
+margins and history, and its charsets state.
+
+A snapshot may be used to survive a restart of the application or to move a
+session to another window:
+
+>>> from pyqonsole import snapshot
+>>> snapshot.save(session.em, 'session.snapshot')
+>>> # later, maybe in another process
+>>> snapshot.restore(session.em, 'session.snapshot')
+
+Snapshot files are memory mapped when restored and history lines are only
+decoded when they are displayed, so that restoring a large history is fast.
+Snapshots are written sequentially and may be written to any stream (see
+dump), and read from a string (see load).
+
+Layout of a snapshot, integers being little endian:
+
+* MAGIC
+* size of the state (unsigned int) and the state, marshalled: the dictionary
+  returned by Emulation.getState, the images and histories of the screens
+  being replaced by the number of lines of the history
+* for each screen, its image, each line being preceded by its size (unsigned
+  int), then its history lines
+* the index: for each screen, the offset of its history lines (unsigned ints,
+  one more than the number of lines), their number of cells (unsigned shorts)
+  and their wrapped flag (unsigned chars)
+* the offset of the index (unsigned int) and MAGIC
+
+A line is encoded as its number of cells and of attribute runs (unsigned
+shorts), the runs (number of cells, foreground and background colors,
+rendition), then its characters in UTF-8, the trailing part of wide
+characters being a null character.
+
+@author: Sylvain Thenault
+@copyright: 2007
+@organization: Logilab
+@license: CECILL
+"""
+
+import os
+import sys
+import mmap
+import marshal
+from array import array
+from struct import pack, unpack, calcsize
+
+from pyqonsole.ca import Ca, DCA
+from pyqonsole.history import HistoryScrollNone, HistoryScrollBuffer
+
+MAGIC = 'PYQSNAP\x01'
+TRAILER = '<I%ss' % len(MAGIC)
+TRAILER_SIZE = calcsize(TRAILER)
+UINT_SIZE = calcsize('<I')
+LINE_HEADER_SIZE = calcsize('<HH')
+RUN_SIZE = calcsize('<HbbB')
+
+
+class SnapshotError(Exception): pass
+
+
+# lines encoding ##############################################################
+
+def encodeLine(cells):
+    """return the given list of Ca encoded as a string"""
+    runs = []
+    count = 0
+    attrs = None
+    for ca in cells:
+        if (ca.f, ca.b, ca.r) != attrs:
+            if count:
+                runs.append(pack('<HbbB', count, *attrs))
+            attrs = (ca.f, ca.b, ca.r)
+            count = 0
+        count += 1
+    if count:
+        runs.append(pack('<HbbB', count, *attrs))
+    text = u''.join([ca.c or u'\0' for ca in cells]).encode('utf-8')
+    return '%s%s%s' % (pack('<HH', len(cells), len(runs)), ''.join(runs),
+                       text)
+
+def decodeLine(data, start, end, cache):
+    """return the list of Ca encoded in data[start:end]. Identical cells are
+    shared through the cache dictionary.
+    """
+    nruns = unpack('<HH', data[start:start+LINE_HEADER_SIZE])[1]
+    pos = start + LINE_HEADER_SIZE + nruns * RUN_SIZE
+    runs = unpack('<' + 'HbbB' * nruns, data[start+LINE_HEADER_SIZE:pos])
+    text = data[pos:end].decode('utf-8')
+    cells = []
+    append = cells.append
+    i = 0
+    for k in xrange(0, len(runs), 4):
+        count, f, b, r = runs[k:k+4]
+        for c in text[i:i+count]:
+            key = (c, f, b, r)
+            ca = cache.get(key)
+            if ca is None:
+                ca = cache[key] = Ca(c != u'\0' and c or None, f, b, r)
+            append(ca)
+        i += count
+    return cells
+
+def _newCache():
+    """return a new cache for decodeLine, sharing the default character"""
+    return {(DCA.c, DCA.f, DCA.b, DCA.r): DCA}
+
+
+class SnapshotLines(object):
+    """history lines of a snapshot, decoded when accessed (see
+    HistoryScrollBuffer.restoreLines)
+    """
+
+    def __init__(self, data, offsets, lengths, wrapped, cache):
+        self.data = data
+        self.offsets = offsets
+        self.lengths = lengths
+        self.wrapped = wrapped
+        self.lines = len(lengths)
+        self._cache = cache
+
+    def getLine(self, lineno):
+        """return the list of Ca of the given line"""
+        return decodeLine(self.data, self.offsets[lineno],
+                          self.offsets[lineno+1], self._cache)
+
+    def getEncodedLine(self, lineno):
+        """return the given line encoded as by encodeLine"""
+        return self.data[self.offsets[lineno]:self.offsets[lineno+1]]
+
+
+# writing #####################################################################
+
+def _littleEndian(values):
+    """return the given array as a little endian string"""
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tostring()
+
+def _encodedHistoryLine(hist, lineno):
+    stored = hist.getStoredLine(lineno)
+    if stored is not None and isinstance(stored[0], SnapshotLines):
+        return stored[0].getEncodedLine(stored[1])
+    return encodeLine(hist.getLine(lineno))
+
+def dump(emulation, stream):
+    """write a snapshot of the emulation to the given stream"""
+    state = emulation.getState()
+    images = []
+    histories = []
+    for scr_state in state['screens']:
+        images.append(scr_state.pop('image'))
+        hist = scr_state['history']
+        histories.append(hist)
+        if isinstance(hist, HistoryScrollBuffer):
+            scr_state['history'] = {'max_lines': hist.max_lines,
+                                    'lines': hist.lines,
+                                    'flowed': hist.flowed,
+                                    'columns': hist.reflow_columns}
+        else:
+            scr_state['history'] = {'max_lines': 0, 'lines': 0}
+    data = marshal.dumps(state)
+    stream.write(MAGIC)
+    stream.write(pack('<I', len(data)))
+    stream.write(data)
+    pos = len(MAGIC) + UINT_SIZE + len(data)
+    index = []
+    for image, hist in zip(images, histories):
+        for line in image:
+            data = encodeLine(line)
+            stream.write(pack('<I', len(data)))
+            stream.write(data)
+            pos += UINT_SIZE + len(data)
+        offsets = array('I')
+        lengths = array('H')
+        wrapped = array('B')
+        for lineno in xrange(hist.lines):
+            data = _encodedHistoryLine(hist, lineno)
+            stream.write(data)
+            offsets.append(pos)
+            lengths.append(hist.getLineLen(lineno))
+            wrapped.append(hist.isWrappedLine(lineno) and 1 or 0)
+            pos += len(data)
+        offsets.append(pos)
+        index += [offsets, lengths, wrapped]
+    for values in index:
+        stream.write(_littleEndian(values))
+    stream.write(pack(TRAILER, pos, MAGIC))
+
+def save(emulation, filename):
+    """write a snapshot of the emulation to the given file. The file is
+    replaced once written, so that a snapshot restored from it is kept
+    valid.
+    """
+    tmpfile = '%s.%s' % (filename, os.getpid())
+    stream = open(tmpfile, 'wb')
+    try:
+        try:
+            dump(emulation, stream)
+        finally:
+            stream.close()
+        os.rename(tmpfile, filename)
+    except:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        raise
+
+
+# reading #####################################################################
+
+def _readArray(typecode, data, start, count):
+    """return an array of count items read from data at the given offset,
+    and the offset following them
+    """
+    values = array(typecode)
+    end = start + count * values.itemsize
+    values.fromstring(data[start:end])
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values, end
+
+def load(emulation, data):
+    """restore a snapshot written by dump from data, a string or a memory
+    mapped file
+    """
+    size = len(data)
+    if (size < len(MAGIC) + UINT_SIZE + TRAILER_SIZE
+        or data[:len(MAGIC)] != MAGIC
+        or data[size-len(MAGIC):size] != MAGIC):
+        raise SnapshotError('not a pyqonsole snapshot')
+    pos = len(MAGIC) + UINT_SIZE
+    state_size = unpack('<I', data[len(MAGIC):pos])[0]
+    try:
+        state = marshal.loads(data[pos:pos+state_size])
+    except (EOFError, ValueError, TypeError):
+        raise SnapshotError('corrupted snapshot state')
+    pos += state_size
+    cache = _newCache()
+    index = unpack(TRAILER, data[size-TRAILER_SIZE:size])[0]
+    for scr_state in state['screens']:
+        image = []
+        for y in xrange(scr_state['lines'] + 1):
+            line_size = unpack('<I', data[pos:pos+UINT_SIZE])[0]
+            pos += UINT_SIZE
+            image.append(decodeLine(data, pos, pos + line_size, cache))
+            pos += line_size
+        scr_state['image'] = image
+        hist_state = scr_state['history']
+        lines = hist_state['lines']
+        offsets, index = _readArray('I', data, index, lines + 1)
+        lengths, index = _readArray('H', data, index, lines)
+        wrapped, index = _readArray('B', data, index, lines)
+        pos = offsets[-1]
+        if not hist_state['max_lines']:
+            scr_state['history'] = HistoryScrollNone()
+            continue
+        hist = HistoryScrollBuffer(hist_state['max_lines'])
+        if lines:
+            hist.restoreLines(SnapshotLines(data, offsets, lengths, wrapped,
+                                            cache))
+            hist.reflow_columns = hist_state['columns']
+            hist.flowed = hist_state['flowed']
+        scr_state['history'] = hist
+    emulation.setState(state)
+
+def restore(emulation, filename):
+    """restore a snapshot from the given file, written by save"""
+    stream = open(filename, 'rb')
+    try:
+        try:
+            data = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError), ex:
+            raise SnapshotError('cannot map %s: %s' % (filename, ex))
+    finally:
+        stream.close()
+    load(emulation, data)
@@ -0,0 +1,57 @@
+# Copyright (c) 2005-2006 LOGILAB S.A. (Paris, FRANCE).
+# Copyright (c) 2005-2006 CEA Grenoble
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the CECILL license, available at
+# http://www.inria.fr/valorisation/logiciels/Licence.CeCILL-V2.pdf
+#
+"""spawn latency benchmark: time taken to fork and exec a short lived child
+(`true` by default) until its exit is notified.
+
+usage: python bench_spawn.py [count [program]]
+
+The soft RLIMIT_NOFILE limit is raised to the hard one first, since the
+spawn used to be proportional to it.
+"""
+
+import sys
+import time
+from resource import getrlimit, setrlimit, RLIMIT_NOFILE
+
+from pyqonsole import pty_, procctrl
+
+
+def bench(count, pgm):
+    times = []
+    for i in xrange(count):
+        process = pty_.PtyProcess()
+        start = time.time()
+        process.start([pgm])
+        deadline = start + 60
+        while process.running and time.time() < deadline:
+            procctrl.theProcessController.waitForProcessExit(1)
+        times.append(time.time() - start)
+    return times
+
+def main(args):
+    count = 20
+    pgm = 'true'
+    if args:
+        count = int(args[0])
+    if args[1:]:
+        pgm = args[1]
+    soft, hard = getrlimit(RLIMIT_NOFILE)
+    try:
+        setrlimit(RLIMIT_NOFILE, (hard, hard))
+        soft = hard
+    except (ValueError, OSError):
+        pass
+    times = bench(count, pgm)
+    print 'RLIMIT_NOFILE: %s' % soft
+    print '%d spawns of %s: min %.2fms, avg %.2fms, max %.2fms' % (
+        count, pgm, min(times) * 1000, sum(times) / len(times) * 1000,
+        max(times) * 1000)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
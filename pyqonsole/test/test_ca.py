@@ -61,6 +61,13 @@ class CaTest(unittest.TestCase):
         self.c2.r = 1
         self.assertNotEqual(self.c1, self.c2)
 
+    def testReversed(self):
+        """ Test reversedCa shares reversed cells.
+        """
+        reverse = reversedCa(Ca(u'a', 3, 4, RE_BOLD))
+        self.assertEqual(reverse, Ca(u'a', 4, 3, RE_BOLD))
+        self.assert_(reversedCa(Ca(u'a', 3, 4, RE_BOLD)) is reverse)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -26,7 +26,8 @@ Pt: A text parameter composed of printable characters.
 """
 
 import unittest
-from utils import NoScreenTC, NullGui, MyEmuVt102, register_logger, reset_logs
+from utils import NoScreenTC, NullGui, NullScreen, MyEmuVt102, \
+     register_logger, reset_logs
 
 from pyqonsole import emuVt102, emulation, ca, screen
 
@@ -37,6 +38,9 @@ class EmuVtTC(NoScreenTC):
         NoScreenTC.setUp(self)
         self.emu = MyEmuVt102(NullGui())
         self.emu._connected = True
+        # the alternate screen is created when first used, create it now to
+        # check sequences affecting it
+        self.emu._screen[1] = NullScreen()
         register_logger(self.emu)
         reset_logs()
         
@@ -207,6 +211,7 @@ ESC ~ 		Invoke the G1 Character Set as GR (LS1R).
                             gui=[('getattr', 'setMouseMarks'), ('call', (True,))],
                             emu=[('resetMode', (9,)), ('saveMode', (9,)),
                                  ('resetMode', (6,)), ('saveMode', (6,)),
+                                 ('resetMode', (11,)), ('saveMode', (11,)),
                                  ('setMode', (10,)),
                                  ('resetMode', (7,)), ('saveMode', (7,)),
                                  ('resetMode', (5,)), ('resetMode', (8,)),
@@ -1142,7 +1147,143 @@ class EmuVt102ModesTC(EmuVtTC):
             self.emu.resetMode(mode)
             for omode in EMU_MODES:
                 self.failUnless(not self.emu.getMode(omode))
+
+
+class EmulationFlowControlTC(EmuVtTC):
+
+    def test_lock_pty_when_falling_behind(self):
+        emu = self.emu
+        # NullScreen can't cook images
+        emu._screen[0] = emu._scr = screen.Screen(NullGui.lines,
+                                                  NullGui.columns)
+        emu.onRcvBlock('x' * (emulation.FLOW_HIGH_WATER + 1))
+        self.failUnless(('lockPty', (True,)) in emu._logs)
+        reset_logs()
+        emu._showBulk()
+        self.failUnlessEqual(emu._logs, [('lockPty', (False,))])
+        reset_logs()
+        emu._showBulk()
+        self.failUnlessEqual(emu._logs, [])
+
+    def test_block_decoding(self):
+        emu = self.emu
+        emu._connected = False
+        emu._setCodec(1) # utf8
+        reset_logs()
+        # multi-bytes sequence split across two blocks
+        emu.onRcvBlock('a\xc3')
+        emu.onRcvBlock('\xa9')
+        self.failUnlessEqual(emu._screen[0]._logs,
+                             [('getattr', 'showCharacter'), ('call', (ord('a'),)),
+                              ('getattr', 'showCharacter'), ('call', (0xe9,))])
+
+    def test_parse_only_while_disconnected(self):
+        emu = self.emu
+        emu._screen[0] = emu._scr = screen.Screen(NullGui.lines,
+                                                  NullGui.columns)
+        emu.setConnect(False)
+        reset_logs()
+        emu.onRcvBlock('x\n' * (emulation.FLOW_HIGH_WATER + 1))
+        self.failIf(emu._bulk_timer.isActive())
+        self.failIf(('lockPty', (True,)) in emu._logs)
+        refreshes = emu.refreshes
+        emu.setConnect(True)
+        self.failUnlessEqual(emu.refreshes, refreshes + 1)
                 
+
+
+class EmulationPasteTC(EmuVtTC):
+
+    def setUp(self):
+        EmuVtTC.setUp(self)
+        self.emu._connected = True
+        reset_logs()
+
+    def _sent(self):
+        return [args[0] for signal, args in self.emu._logs
+                if signal == 'sndBlock']
+
+    def test_paste_chunks(self):
+        emu = self.emu
+        emu.onPaste(u'x' * (emulation.PASTE_CHUNK + 1))
+        self.failUnlessEqual(self._sent(), ['x' * emulation.PASTE_CHUNK])
+        emu._pasteNext() # paste timer
+        self.failUnlessEqual(self._sent(), ['x' * emulation.PASTE_CHUNK, 'x'])
+
+    def test_paste_wait_for_pty(self):
+        emu = self.emu
+        emu.onBufferFull()
+        emu.onPaste(u'abc')
+        self.failUnlessEqual(self._sent(), [])
+        emu.onBufferEmpty()
+        emu._pasteNext() # paste timer
+        self.failUnlessEqual(self._sent(), ['abc'])
+
+    def test_cancel_paste(self):
+        emu = self.emu
+        emu.setMode(emuVt102.MODE_BracketedPaste)
+        emu.onPaste(u'x' * (emulation.PASTE_CHUNK + 1))
+        emu.cancelPaste()
+        emu._pasteNext()
+        self.failUnlessEqual(self._sent(),
+                             ['\033[200~' + 'x' * (emulation.PASTE_CHUNK - 6),
+                              '\033[201~'])
+
+    def test_bracketed_paste(self):
+        emu = self.emu
+        emu._connected = False
+        emu.onRcvBlock('\033[?2004h')
+        emu._connected = True
+        emu.onPaste(u'a\033[201~b')
+        self.failUnlessEqual(self._sent(), ['\033[200~ab\033[201~'])
+        reset_logs()
+        emu._connected = False
+        emu.onRcvBlock('\033[?2004l')
+        emu._connected = True
+        emu.onPaste(u'c')
+        self.failUnlessEqual(self._sent(), ['c'])
+        
+
+class AlternateScreenTC(unittest.TestCase):
+
+    def setUp(self):
+        self.emu = emuVt102.EmuVt102(NullGui())
+        self.emu._connected = True
+
+    def _send(self, seq):
+        for c in seq:
+            self.emu.onRcvChar(ord(c))
+
+    def test_created_when_used(self):
+        self.failUnless(self.emu._screen[1] is None)
+        self._send('\033[?1049h')
+        alt = self.emu._screen[1]
+        self.failIf(alt is None)
+        self.failUnless(self.emu._scr is alt)
+        self.assertEquals((alt.lines, alt.columns), (60, 72))
+
+    def test_released_once_left(self):
+        self._send('\033[?1049h')
+        self.emu._releaseAlternateScreen()
+        self.failIf(self.emu._screen[1] is None)
+        self._send('\033[?1049l')
+        self.failUnless(self.emu._scr is self.emu._screen[0])
+        self.emu._releaseAlternateScreen()
+        self.failUnless(self.emu._screen[1] is None)
+
+    def test_resized_when_switched_to(self):
+        self._send('\033[?1049h\033[?1049l')
+        alt = self.emu._screen[1]
+        self.emu.onImageSizeChange(20, 40)
+        self.assertEquals((alt.lines, alt.columns), (60, 72))
+        self._send('\033[?1049h')
+        self.failUnless(self.emu._scr is alt)
+        self.assertEquals((alt.lines, alt.columns), (20, 40))
+
+    def test_shared_margins(self):
+        self._send('\033[5;10r\033[?1049h')
+        self.assertEquals(self.emu._screen[1].getMargins(), (4, 9))
+
         
 if __name__ == '__main__':
     unittest.main()
@@ -11,6 +11,7 @@
 import unittest
 
 from pyqonsole.history import  *
+from pyqonsole.ca import Ca
 
 class HistoryScrollNoneTC(unittest.TestCase):
     def setUp(self):
@@ -64,6 +65,27 @@ class HistoryScrollBufferTC(unittest.TestCase):
         self.failUnlessEqual(history.buff_filled, True)
         self.failUnlessEqual(history.hist_buffer, ['666666', '22', '333', '4444', '55555'])
 
+    def test_cells(self):
+        history = self.history
+        for cells in ('1', '22', '333', '4444', '55555', '666666'):
+            history.addCells(cells, True)
+        self.failUnlessEqual(history.cells, 18) # '1' and '22' dropped
+        history._normalize()
+        self.failUnlessEqual(history.cells, 15)
+        history.setMaxLines(3)
+        self.failUnlessEqual(history.cells, len(''.join([history.getLine(i)
+                                                         for i in xrange(history.lines)])))
+
+    def test_cells_while_full(self):
+        history = self.history
+        for size in xrange(1, 20):
+            history.addCells('x' * size)
+            self.failUnlessEqual(history.cells,
+                                 sum([history.getLineLen(i)
+                                      for i in xrange(history.lines)]))
+        history.popLine()
+        self.failUnlessEqual(history.cells, 16 + 17 + 18)
+
     def test__normalize(self):
         history = self.history
         for cells in ('1', '22', '333', '4444', '55555', '666666'):
@@ -101,5 +123,51 @@ class HistoryScrollBufferTC(unittest.TestCase):
         history.addCells('88888888')
         self.failUnlessEqual(history.hist_buffer, ['7777777', '88888888', None])
         
+    def test_full_lines(self):
+        history = self.history
+        for cells in ('1', '22', '333', '4444', '55555', '666666'):
+            history.addCells(cells, True)
+        self.failUnlessEqual([history.getLine(i) for i in xrange(history.lines)],
+                             ['333', '4444', '55555', '666666'])
+
+    def test_reflow(self):
+        history = HistoryScrollBuffer(10)
+        for text, wrapped in (('abcd', True), ('ef', False), ('ghij', False),
+                              ('klmn', True), ('o', False)):
+            history.addCells([Ca(c) for c in text], wrapped)
+        history.reflow(3)
+        self.failUnlessEqual(history.flowed, 5)
+        # 'klmn' is now the fifth line, lines from the sixth one moved by one
+        self.failUnlessEqual(history.reflowFrom(3), (4, 5, 1))
+        self.failUnlessEqual(history.flowed, 0)
+        self.failUnlessEqual(history.reflowFrom(0), None)
+        self.failUnlessEqual([u''.join([ca.c for ca in history.getLine(i)])
+                              for i in xrange(history.lines)],
+                             [u'abc', u'def', u'ghi', u'j', u'klm', u'no'])
+        self.failUnlessEqual([history.isWrappedLine(i)
+                              for i in xrange(history.lines)],
+                             [True, False, True, False, True, False])
+        self.failUnlessEqual(history.cells, 15)
+
+    def test_reflow_full(self):
+        history = self.history
+        for text in ('ab', 'cd', 'ef', 'ghijkl', 'mn', 'op'):
+            history.addCells([Ca(c) for c in text])
+        history.reflow(4)
+        # the first line is dropped
+        history.addCells([Ca(c) for c in 'qr'])
+        self.failUnlessEqual(history.flowed, 3)
+        # 'ghijkl' is rewrapped on two lines, the first one is dropped
+        self.failUnlessEqual(history.reflowFrom(0), (0, 3, 0))
+        self.failUnlessEqual([u''.join([ca.c for ca in history.getLine(i)])
+                              for i in xrange(history.lines)],
+                             [u'kl', u'mn', u'op', u'qr'])
+        self.failUnlessEqual(history.cells, 8)
+        history.addCells([Ca(c) for c in 'st'])
+        self.failUnlessEqual(history.getLine(3), [Ca(c) for c in 'st'])
+        self.failUnlessEqual(history.popLine(), [Ca(c) for c in 'st'])
+        self.failUnlessEqual(history.lines, 3)
+        self.failUnlessEqual(history.getLine(2), [Ca(c) for c in 'qr'])
+
 if __name__ == '__main__':
     unittest.main()
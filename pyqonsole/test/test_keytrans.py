@@ -9,11 +9,30 @@
 """Test pyqonsole's keytrans module.
 """
 import unittest
+from os.path import join, dirname, exists
+from shutil import rmtree
+from tempfile import mkdtemp
 
 import qt
 from pyqonsole import keytrans
 
-class ParserTC(unittest.TestCase):
+class KeytabCacheTC(unittest.TestCase):
+    """write the keytab cache to a temporary directory"""
+
+    def setUp(self):
+        self._cache_file = keytrans.KEYTAB_CACHE_FILE
+        self._reader = keytrans.KeytabReader
+        keytrans.KEYTAB_CACHE_FILE = join(mkdtemp(), 'cache', 'keytabs')
+        keytrans._CACHE = None
+
+    def tearDown(self):
+        rmtree(dirname(dirname(keytrans.KEYTAB_CACHE_FILE)))
+        keytrans.KEYTAB_CACHE_FILE = self._cache_file
+        keytrans.KeytabReader = self._reader
+        keytrans._CACHE = None
+
+
+class ParserTC(KeytabCacheTC):
 
     def test_parse_default_config(self):
         kt = keytrans.KeyTrans()
@@ -35,6 +54,53 @@ class ParserTC(unittest.TestCase):
         entry = kt.findEntry(qt.Qt.Key_Return, False, True, False, False, False, False)
         self.failUnlessEqual(entry.cmd, keytrans.CMD_send)
         self.failUnlessEqual(entry.txt, '\r')
+
+    def test_index_matches_table_order(self):
+        kt = keytrans.KeyTrans()
+        kt.readConfig()
+        for key in dict.fromkeys([entry.key for entry in kt._table]):
+            for bits in xrange(1 << keytrans.BITS_COUNT):
+                expected = None
+                for entry in kt._table:
+                    if entry.matches(key, bits, 0xffff):
+                        expected = entry
+                        break
+                try:
+                    found = kt._findEntry(key, bits)
+                except keytrans.EntryNotFound:
+                    found = None
+                self.failUnless(found is expected, (key, bits))
+
+    def test_entry_not_found(self):
+        kt = keytrans.KeyTrans()
+        kt.readConfig()
+        self.assertRaises(keytrans.EntryNotFound, kt._findEntry, -1, 0)
+
+
+class CacheTC(KeytabCacheTC):
+
+    def _entries(self, kt):
+        return [(e.ref, e.key, e.bits, e.mask, e.cmd, e.txt) for e in kt._table]
+        
+    def test_cached_keytab(self):
+        parsed = keytrans.KeyTrans()
+        parsed.readConfig()
+        self.failUnless(exists(keytrans.KEYTAB_CACHE_FILE))
+        # next process start: read the cache instead of parsing
+        keytrans._CACHE = None
+        keytrans.KeytabReader = None
+        cached = keytrans.KeyTrans()
+        cached.readConfig()
+        self.failUnlessEqual(cached.hdr(), parsed.hdr())
+        self.failUnlessEqual(self._entries(cached), self._entries(parsed))
+
+    def test_outdated_cache(self):
+        keytrans._loadCache()[keytrans.DEFAULT_KEYTAB_FILE] = (0, 0, 'outdated', [])
+        kt = keytrans.KeyTrans()
+        kt.readConfig()
+        self.failIfEqual(kt.hdr(), 'outdated')
+        self.failUnless(kt._table)
+
         
 if __name__ == '__main__':
     unittest.main()
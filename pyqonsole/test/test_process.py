@@ -8,6 +8,9 @@
 #
 import unittest
 import time
+import os
+import fcntl
+import tty
 
 from pyqonsole import pty_, procctrl
 
@@ -48,6 +51,127 @@ class ProcessTC(unittest.TestCase):
         # process controller interaction
         #self.failUnless(not p in procctrl.theProcessController.process_list)
 
+    def test_start_failure(self):
+        p = self.process
+        p.start(['/nonexistent/program'])
+        self.failUnlessEqual(p.running, False)
+        self.failUnlessEqual(p.pid, 0)
+
+    def test_exit_dispatch(self):
+        controller = procctrl.theProcessController
+        p1 = self.process
+        p2 = pty_.PtyProcess()
+        p2.run('sleep', ['0.5'], 'xterm', False)
+        p1.run('true', [], 'xterm', False)
+        deadline = time.time() + 10
+        while (p1.running or p2.running) and time.time() < deadline:
+            controller.waitForProcessExit(1)
+        self.failUnlessEqual(p1.running, False)
+        self.failUnlessEqual(p2.running, False)
+        self.failUnlessEqual(p1.status, 0)
+        self.failUnlessEqual(p2.status, 0)
+        self.failIf(p1.pid in controller._processes)
+        self.failIf(p2.pid in controller._processes)
+
+    def test_foreign_children_not_reaped(self):
+        controller = procctrl.theProcessController
+        pid = os.spawnlp(os.P_NOWAIT, 'true', 'true')
+        p = self.process
+        p.run('true', [], 'xterm', False)
+        deadline = time.time() + 10
+        while p.running and time.time() < deadline:
+            controller.waitForProcessExit(1)
+        self.failUnlessEqual(p.running, False)
+        # left to its owner
+        self.failUnlessEqual(os.waitpid(pid, 0), (pid, 0))
+
+    def test_pool(self):
+        pool = pty_.PtyPool('sleep', ['10'], 'xterm', 2)
+        pool.fill()
+        self.failUnlessEqual(len(pool.idle), 2)
+        p = pool.take('sleep', ['10'], 'xterm')
+        self.failUnlessEqual(p.running, True)
+        self.failUnlessEqual(len(pool.idle), 1)
+        self.failUnlessEqual(pool.take('sleep', ['5'], 'xterm'), None)
+        pool.fill()
+        self.failUnlessEqual(len(pool.idle), 2)
+        p.kill(9)
+        pool.close()
+        self.failUnlessEqual(pool.idle, [])
+
+    def test_data_received_drains_fd(self):
+        p = self.process
+        blocks = []
+        p.myconnect('block_in', blocks.append)
+        rfd, wfd = os.pipe()
+        fcntl.fcntl(rfd, fcntl.F_SETFL, os.O_NONBLOCK)
+        os.write(wfd, 'x' * 10000)
+        lenlist = [-1]
+        p.dataReceived(rfd, lenlist)
+        self.failUnlessEqual(lenlist, [10000])
+        self.failUnlessEqual(blocks, ['x' * 10000])
+        # nothing available is not end of file
+        lenlist = [-1]
+        p.dataReceived(rfd, lenlist)
+        self.failUnlessEqual(lenlist, [-1])
+        os.close(wfd)
+        p.dataReceived(rfd, lenlist)
+        self.failUnlessEqual(lenlist, [0])
+        self.failUnlessEqual(len(blocks), 1)
+        os.close(rfd)
+
+    def test_send_queue(self):
+        p = self.process
+        tty.setraw(p.slave_fd)
+        fcntl.fcntl(p.slave_fd, fcntl.F_SETFL, os.O_NONBLOCK)
+        data = ''.join([chr(i % 256) for i in xrange(100000)])
+        # nobody reads the slave side yet, so most of the data gets queued
+        p.sendBytes(data[:50000])
+        p.sendBytes(data[50000:])
+        self.failUnless(p.sendQueueSize() > 0)
+        received = []
+        while p.sendQueueSize():
+            try:
+                received.append(os.read(p.slave_fd, 65536))
+            except OSError:
+                pass
+            p.doSendJobs()
+        while True:
+            try:
+                received.append(os.read(p.slave_fd, 65536))
+            except OSError:
+                break
+        self.failUnlessEqual(''.join(received), data)
+
+    def test_send_queue_after_close(self):
+        p = self.process
+        p._clearSendQueue()
+        # a reply of the emulation while the line is being closed
+        p._queueSend('x')
+        p.doSendJobs()
+        self.failUnlessEqual(p.sendQueueSize(), 0)
+
+    def test_send_queue_overflow(self):
+        p = self.process
+        overflows = []
+        p.myconnect('sendOverflow', overflows.append)
+        p.sendBytes('x' * pty_.SEND_QUEUE_MAX)
+        # the part which couldn't be written is queued
+        queued = p.sendQueueSize()
+        self.failUnless(queued > 0)
+        self.failUnlessEqual(queued + p.bytes_written, pty_.SEND_QUEUE_MAX)
+        p.sendBytes('y' * pty_.SEND_QUEUE_MAX)
+        self.failUnlessEqual(overflows, [pty_.SEND_QUEUE_MAX])
+        self.failUnlessEqual(p.sendQueueSize(), queued)
+
+    def test_send_queue_overflow_first_string(self):
+        p = self.process
+        overflows = []
+        p.myconnect('sendOverflow', overflows.append)
+        p.sendBytes('x' * pty_.SEND_QUEUE_MAX * 2)
+        self.failUnlessEqual(len(overflows), 1)
+        self.failUnlessEqual(p.sendQueueSize(), 0)
+
         
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,115 @@
+# Copyright (c) 2005-2007 LOGILAB S.A. (Paris, FRANCE).
+# Copyright (c) 2005-2006 CEA Grenoble 
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the CECILL license, available at
+# http://www.inria.fr/valorisation/logiciels/Licence.CeCILL-V2.pdf
+#
+"""Test pyqonsole's profiling module.
+"""
+import os
+import sys
+import time
+import signal
+import unittest
+from cStringIO import StringIO
+from os.path import join, exists
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from pyqonsole import profiling
+
+class ImportTimerTC(unittest.TestCase):
+
+    def tearDown(self):
+        profiling.uninstallImportTimer()
+
+    def test_import_times(self):
+        sys.modules.pop('colorsys', None)
+        profiling.installImportTimer()
+        import colorsys
+        profiling.uninstallImportTimer()
+        names = [name for own, incl, name in profiling.importTimes()]
+        self.failUnless('colorsys' in names)
+        stream = StringIO()
+        profiling.startupReport(stream)
+        self.failUnless('colorsys' in stream.getvalue())
+
+    def test_uninstall(self):
+        import __builtin__
+        orig = __builtin__.__import__
+        profiling.installImportTimer()
+        self.failIf(__builtin__.__import__ is orig)
+        profiling.uninstallImportTimer()
+        self.failUnless(__builtin__.__import__ is orig)
+
+def busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+class RuntimeProfilersTC(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def test_profiler_windows(self):
+        profiler = profiling.Profiler(join(self.tmpdir, 'prof'))
+        profiler.toggle()
+        busy(0.01)
+        profiler.toggle()
+        busy(0.01) # not profiled
+        profiler.start()
+        busy(0.01)
+        profiler.stop()
+        self.failUnlessEqual(profiler.windows, 2)
+        for path in ('prof.1', 'prof.2'):
+            self.failUnless(exists(join(self.tmpdir, path)))
+        callgrind = open(join(self.tmpdir, 'prof.2.callgrind')).read()
+        self.failUnless('fn=busy:' in callgrind)
+
+    def test_profiler_signal(self):
+        profiler = profiling.Profiler(join(self.tmpdir, 'prof'))
+        old_handler = signal.getsignal(signal.SIGUSR1)
+        try:
+            profiler.toggleOnSignal(signal.SIGUSR1)
+            os.kill(os.getpid(), signal.SIGUSR1)
+            self.failUnless(profiler.running)
+            os.kill(os.getpid(), signal.SIGUSR1)
+            self.failIf(profiler.running)
+        finally:
+            signal.signal(signal.SIGUSR1, old_handler)
+
+    def test_sampler(self):
+        if not hasattr(signal, 'setitimer'):
+            return
+        sampler = profiling.Sampler(join(self.tmpdir, 'samples'), 0.001)
+        sampler.start()
+        busy(0.2)
+        sampler.stop()
+        lines = open(join(self.tmpdir, 'samples.1')).readlines()
+        self.failUnless(lines)
+        stack, count = lines[0].rsplit(' ', 1)
+        self.failUnless(int(count) > 0)
+        self.failUnless([line for line in lines if 'busy (' in line])
+        stream = StringIO()
+        sampler.report(stream)
+        self.failUnless('busy (' in stream.getvalue())
+
+    def test_profiler_report(self):
+        profiler = profiling.Profiler(join(self.tmpdir, 'prof'))
+        profiler.start()
+        busy(0.01)
+        profiler.stop()
+        stream = StringIO()
+        profiler.report(stream)
+        self.failUnless('busy' in stream.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -46,6 +46,23 @@ class ScreenTC(unittest.TestCase):
                     continue
                 self.failUnlessEqual(image[y][x].c, u' ')
 
+    def test_showCharacter_wide(self):
+        screen = self.screen
+        for c in 'abcdefg':
+            screen.showCharacter(ord(c))
+        screen.showCharacter(0x4e00)
+        self.failUnlessEqual([ca.c for ca in screen._image[0][7:]],
+                             [u'\u4e00', None, u' '])
+        self.failUnlessEqual(screen.getCursorX(), 9)
+        # doesn't fit at the end of the line
+        screen.showCharacter(0x4e01)
+        self.failUnlessEqual([ca.c for ca in screen._image[1][:3]],
+                             [u'\u4e01', None, u' '])
+        self.failUnlessEqual((screen.getCursorY(), screen.getCursorX()), (1, 2))
+        # combining characters are ignored
+        screen.showCharacter(0x0301)
+        self.failUnlessEqual(screen.getCursorX(), 2)
+
     def test_nextLine(self):
         screen = self.screen
         image = screen._image
@@ -77,6 +94,206 @@ class ScreenTC(unittest.TestCase):
         expected[2][0].r |= RE_CURSOR # cursor location
         self.failUnlessEqual(image, expected)
 
+    def test_getCookedImage_reuse(self):
+        screen = self.screen
+        screen.showCharacter(ord('a'))
+        image, wrapped = screen.getCookedImage()
+        image2, wrapped = screen.getCookedImage()
+        self.failIf(image2 is image)
+        for y in xrange(5):
+            self.failUnless(image2[y] is image[y])
+        screen.nextLine()
+        screen.showCharacter(ord('b'))
+        image3, wrapped = screen.getCookedImage()
+        self.failIf(image3[0] is image2[0]) # cursor moved
+        self.failIf(image3[1] is image2[1])
+        self.failUnless(image3[2] is image2[2])
+        self.failUnlessEqual(image3[1][0].c, u'b')
+        # selection
+        screen.setSelBeginXY(0, 2)
+        screen.setSelExtendXY(3, 2)
+        image4, wrapped = screen.getCookedImage()
+        self.failUnless(image4[0] is image3[0])
+        self.failIf(image4[2] is image3[2])
+        self.failUnlessEqual(image4[2][0].f, DEFAULT_BACK_COLOR)
+        self.failUnlessEqual(image4[2][4].f, DEFAULT_FORE_COLOR)
+        # scrolling the screen into the history
+        screen.resetMode(MODE_Cursor)
+        screen.clearSelection()
+        for i in xrange(4):
+            screen.nextLine()
+        image5, wrapped = screen.getCookedImage()
+        self.failUnlessEqual(image5[0][0].c, u'b')
+        screen.hist_cursor -= 1
+        image6, wrapped = screen.getCookedImage()
+        self.failUnlessEqual(image6[0][0].c, u'a')
+        self.failUnlessEqual(image6[1][0].c, u'b')
+        image7, wrapped = screen.getCookedImage()
+        self.failUnless(image7[0] is image6[0])
+
+    def test_selectedRange(self):
+        screen = self.screen
+        self.failUnlessEqual(screen._selectedRange(0), None)
+        screen.setSelBeginXY(5, 1)
+        screen.setSelExtendXY(2, 3)
+        self.failUnlessEqual(screen._selectedRange(0), None)
+        self.failUnlessEqual(screen._selectedRange(1), (5, 9))
+        self.failUnlessEqual(screen._selectedRange(2), (0, 9))
+        self.failUnlessEqual(screen._selectedRange(3), (0, 2))
+        self.failUnlessEqual(screen._selectedRange(4), None)
+        image, wrapped = screen.getCookedImage()
+        for y in xrange(5):
+            for x in xrange(10):
+                self.failUnlessEqual(image[y][x].b == DEFAULT_FORE_COLOR,
+                                     screen.testIsSelected(x, y), (x, y))
+
+    def test_getCookedImage_screen_mode(self):
+        screen = self.screen
+        screen.showCharacter(ord('a'))
+        image, wrapped = screen.getCookedImage()
+        screen.setMode(MODE_Screen)
+        image2, wrapped = screen.getCookedImage()
+        # reverse video is left to the display
+        self.failUnlessEqual(image2[0][0], Ca(u'a'))
+        for y in xrange(5):
+            self.failUnless(image2[y] is image[y])
+
+    def test_getSelText(self):
+        screen = self.screen
+        self.failUnlessEqual(screen.getSelText(True), None)
+        for c in 'abcdefghijklmn': # wrapped line
+            screen.showCharacter(ord(c))
+        screen.nextLine()
+        for c in 'xyz 123456': # full line, not wrapped
+            screen.showCharacter(ord(c))
+        screen.nextLine()
+        screen.nextLine()
+        for c in 'end  ':
+            screen.showCharacter(ord(c))
+        screen.setSelBeginXY(2, 0)
+        screen.setSelExtendXY(9, 4)
+        self.failUnlessEqual(screen.getSelText(True),
+                             u'cdefghijklmn\nxyz 123456\n\nend')
+        self.failUnlessEqual(screen.getSelText(False),
+                             u'cdefghijklmn xyz 123456  end')
+        # first lines in the history
+        screen.nextLine()
+        screen.nextLine()
+        screen.hist_cursor = 0
+        screen.setSelBeginXY(1, 0)
+        screen.setSelExtendXY(1, 2)
+        self.failUnlessEqual(screen.getSelText(True), u'bcdefghijklmn\nxy')
+
+    def _text(self, line):
+        return u''.join([ca.c or u'' for ca in line]).rstrip()
+
+    def test_resizeImage_reflow(self):
+        screen = self.screen
+        screen.reflow = True
+        for c in 'abcdefghijklmn': # wrapped line
+            screen.showCharacter(ord(c))
+        screen.nextLine()
+        for c in 'xyz':
+            screen.showCharacter(ord(c))
+        screen.resizeImage(5, 20)
+        image, wrapped = screen.getCookedImage()
+        self.failUnlessEqual([self._text(line) for line in image[:3]],
+                             [u'abcdefghijklmn', u'xyz', u''])
+        self.failUnlessEqual(wrapped[:2], [False, False])
+        self.failUnlessEqual((screen.getCursorY(), screen.getCursorX()), (1, 3))
+        screen.resizeImage(5, 4)
+        image, wrapped = screen.getCookedImage()
+        self.failUnlessEqual([self._text(line) for line in image],
+                             [u'abcd', u'efgh', u'ijkl', u'mn', u'xyz'])
+        self.failUnlessEqual(wrapped, [True, True, True, False, False])
+        self.failUnlessEqual((screen.getCursorY(), screen.getCursorX()), (4, 3))
+        # lines which don't fit anymore go to the history
+        screen.resizeImage(5, 3)
+        self.failUnlessEqual(screen.getHistLines(), 1)
+        image, wrapped = screen.getCookedImage()
+        self.failUnlessEqual([self._text(line) for line in image],
+                             [u'def', u'ghi', u'jkl', u'mn', u'xyz'])
+        self.failUnlessEqual((screen.getCursorY(), screen.getCursorX()), (4, 2))
+        # the end of the line in the history is rewrapped with the screen
+        screen.resizeImage(5, 10)
+        self.failUnlessEqual(screen.getHistLines(), 0)
+        image, wrapped = screen.getCookedImage()
+        self.failUnlessEqual([self._text(line) for line in image[:3]],
+                             [u'abcdefghij', u'klmn', u'xyz'])
+        # the cursor has been moved back to the last column by the previous
+        # resize
+        self.failUnlessEqual((screen.getCursorY(), screen.getCursorX()), (2, 2))
+        # history lines are rewrapped when displayed
+        for i in xrange(4):
+            screen.nextLine()
+        self.failUnlessEqual(screen.getHistLines(), 2)
+        screen.resizeImage(5, 4)
+        self.failUnlessEqual(screen._hist.flowed, 2)
+        screen.hist_cursor = 0
+        image, wrapped = screen.getCookedImage()
+        self.failUnlessEqual(screen._hist.flowed, 0)
+        self.failUnlessEqual(screen.getHistLines(), 4)
+        self.failUnlessEqual([self._text(line) for line in image[:4]],
+                             [u'abcd', u'efgh', u'ijkl', u'mn'])
+
+    def test_resizeImage_reflow_wide(self):
+        screen = self.screen
+        screen.reflow = True
+        for c in u'abc\u4e00':
+            screen.showCharacter(ord(c))
+        screen.resizeImage(5, 4)
+        image, wrapped = screen.getCookedImage()
+        self.failUnlessEqual(self._text(image[0]), u'abc')
+        self.failUnlessEqual(self._text(image[1]), u'\u4e00')
+        self.failUnlessEqual(image[1][1].c, None)
+        # the blank cell left before the wide character isn't a space
+        screen.resizeImage(5, 10)
+        image, wrapped = screen.getCookedImage()
+        self.failUnlessEqual(self._text(image[0]), u'abc\u4e00')
+        for c in u'de':
+            screen.showCharacter(ord(c))
+        for columns in (4, 10, 4):
+            screen.resizeImage(5, columns)
+        image, wrapped = screen.getCookedImage()
+        self.failUnlessEqual([self._text(line) for line in image[:2]],
+                             [u'abc', u'\u4e00de'])
+        # same thing for history lines
+        for i in xrange(5):
+            screen.nextLine()
+        self.failUnlessEqual(screen.getHistLines(), 2)
+        screen.resizeImage(5, 10)
+        screen.hist_cursor = 0
+        image, wrapped = screen.getCookedImage()
+        self.failUnlessEqual(self._text(image[0]), u'abc\u4e00de')
+
+    def test_resizeImage_reflow_below_cursor(self):
+        screen = self.screen
+        screen.reflow = True
+        for y in xrange(5):
+            for c in 'line%s' % y:
+                screen.showCharacter(ord(c))
+            if y < 4:
+                screen.nextLine()
+        screen.setCursorYX(2, 1)
+        screen.resizeImage(2, 6)
+        # lines above the cursor go to the history, lines below which don't
+        # fit are lost
+        self.failUnlessEqual(screen.getHistLines(), 1)
+        self.failUnlessEqual((screen.getCursorY(), screen.getCursorX()), (0, 0))
+        image, wrapped = screen.getCookedImage()
+        self.failUnlessEqual([self._text(line) for line in image],
+                             [u'line1', u'line2'])
+        screen.resizeImage(2, 3)
+        self.failUnlessEqual((screen.getCursorY(), screen.getCursorX()), (0, 0))
+        image, wrapped = screen.getCookedImage()
+        self.failUnlessEqual([self._text(line) for line in image],
+                             [u'lin', u'e1'])
+        screen.showCharacter(ord('x'))
+        screen.resizeImage(5, 10)
+        self.failUnlessEqual((screen.getCursorY(), screen.getCursorX()), (0, 1))
+        image, wrapped = screen.getCookedImage()
+        self.failUnlessEqual(self._text(image[0]), u'xine1')
+
     def test_modes(self):
         SCREEN_MODES = (MODE_Origin, MODE_Wrap, MODE_Insert, MODE_Screen, MODE_Cursor, MODE_NewLine)
         # reset modes so all modes are unset
@@ -13,7 +13,7 @@ import time
 from utils import NullGui, NoScreenTC, register_logger, reset_logs
 from qt import QApplication
 
-from pyqonsole import session, emulation
+from pyqonsole import session, emulation, pty_
 
 class MySession(session.Session):
     def emit(self, signal, args):
@@ -55,6 +55,52 @@ class SessionTC(NoScreenTC):
         session.notifySessionState(emulation.NOTIFYACTIVITY)
         self.failUnlessEqual(session._logs, [('notifySessionState', (2,))])
 
+    def test_monitor_edges(self):
+        session = self.session
+        session.monitor_activity = True
+        session.notifySessionState(emulation.NOTIFYACTIVITY)
+        session.notifySessionState(emulation.NOTIFYACTIVITY)
+        self.failUnlessEqual(session._logs, [('notifySessionState', (2,))])
+        session.notifySessionState(emulation.NOTIFYNORMAL)
+        session.notifySessionState(emulation.NOTIFYACTIVITY)
+        self.failUnlessEqual(session._logs, [('notifySessionState', (2,)),
+                                             ('notifySessionState', (0,)),
+                                             ('notifySessionState', (2,))])
+        session._logs = []
+        session.SILENCE_TIMEOUT = 1
+        session.monitor_silence = True
+        session.monitorTimerDone()
+        self.failUnlessEqual(session._logs, [])
+        time.sleep(2e-3)
+        session.monitorTimerDone()
+        session.monitorTimerDone()
+        self.failUnlessEqual(session._logs, [('notifySessionState', (3,))])
+        session.notifySessionState(emulation.NOTIFYACTIVITY)
+        self.failUnlessEqual(session._logs, [('notifySessionState', (3,)),
+                                             ('notifySessionState', (2,))])
+        session.monitor_silence = False
+
+    def test_pool_adoption(self):
+        pool = pty_.PtyPool('sleep', ['10'], 'xterm', 1)
+        pool.fill()
+        idle = pool.idle[0]
+        adopting = MySession(NullGui(), 'sleep', ['10'], 'xterm', pool=pool)
+        self.failUnless(adopting.sh is idle)
+        other = MySession(NullGui(), 'sleep', ['10'], 'xterm', cwd='/', pool=pool)
+        self.failIf(other.sh is idle)
+        idle.kill(9)
+        pool.close()
+
+    def test_metrics(self):
+        session = self.session
+        session.em.onRcvBlock('ab\r\n\033[1m')
+        metrics = session.metrics()
+        self.failUnlessEqual(metrics['tokens'],
+                             {'CHR': 2, 'CTL': 2, 'ESC': 0, 'CSI': 1, 'VT52': 0})
+        self.failUnlessEqual(metrics['bytes_read'], 0)
+        self.failUnlessEqual(metrics['send_queue'], 0)
+        self.failUnless(metrics['parse_time'] >= 0)
+
     def test_keymap(self):
         session = self.session
         #self.failUnlessEqual(session.keymapNo(), 0)
@@ -0,0 +1,88 @@
+# Copyright (c) 2005-2007 LOGILAB S.A. (Paris, FRANCE).
+# Copyright (c) 2005-2006 CEA Grenoble 
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the CECILL license, available at
+# http://www.inria.fr/valorisation/logiciels/Licence.CeCILL-V2.pdf
+#
+"""Test pyqonsole's Signalable class.
+"""
+import sys
+import unittest
+from cStringIO import StringIO
+
+import pyqonsole
+from pyqonsole import Signalable
+
+class SignalableTC(unittest.TestCase):
+
+    def setUp(self):
+        self.obj = Signalable()
+        self.calls = []
+
+    def tearDown(self):
+        pyqonsole.disableSignalStats()
+        pyqonsole.SIGNAL_STATS.clear()
+
+    def callback(self, *args):
+        self.calls.append(args)
+
+    def test_emit(self):
+        obj = self.obj
+        obj.myemit('signal', (1,)) # no callback
+        obj.myconnect('signal', self.callback)
+        obj.myconnect('signal', self.callback)
+        obj.myemit('signal', (1, 2))
+        self.failUnlessEqual(self.calls, [(1, 2), (1, 2)])
+        obj.mydisconnect('signal', self.callback)
+        obj.myemit('signal')
+        self.failUnlessEqual(self.calls, [(1, 2), (1, 2), ()])
+
+    def test_disconnect_while_emitting(self):
+        obj = self.obj
+        def disconnecting():
+            obj.mydisconnect('signal', disconnecting)
+        obj.myconnect('signal', disconnecting)
+        obj.myconnect('signal', self.callback)
+        obj.myemit('signal')
+        obj.myemit('signal')
+        self.failUnlessEqual(self.calls, [(), ()])
+
+    def test_callback_error(self):
+        obj = self.obj
+        def failing():
+            raise ValueError()
+        obj.myconnect('signal', failing)
+        obj.myconnect('signal', self.callback)
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            obj.myemit('signal')
+            output = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        self.failUnless('ValueError' in output)
+        self.failUnlessEqual(self.calls, [()])
+
+    def test_stats(self):
+        obj = self.obj
+        obj.myconnect('signal', self.callback)
+        obj.myemit('signal')
+        self.failUnlessEqual(pyqonsole.SIGNAL_STATS, {})
+        pyqonsole.enableSignalStats()
+        obj.myemit('signal')
+        obj.myemit('signal')
+        obj.myemit('other')
+        self.failUnlessEqual(pyqonsole.SIGNAL_STATS['signal'][0], 2)
+        self.failUnlessEqual(pyqonsole.SIGNAL_STATS['other'][0], 1)
+        self.failUnlessEqual(self.calls, [(), (), ()])
+        stream = StringIO()
+        pyqonsole.printSignalStats(stream)
+        self.failUnless('signal' in stream.getvalue())
+        pyqonsole.disableSignalStats()
+        obj.myemit('signal')
+        self.failUnlessEqual(pyqonsole.SIGNAL_STATS['signal'][0], 2)
+
+if __name__ == '__main__':
+    unittest.main()
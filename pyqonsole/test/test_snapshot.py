@@ -0,0 +1,206 @@
+# Copyright (c) 2005-2007 LOGILAB S.A. (Paris, FRANCE).
+# Copyright (c) 2005-2006 CEA Grenoble
+# http://www.logilab.fr/ -- mailto:contact@logilab.fr
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the CECILL license, available at
+# http://www.inria.fr/valorisation/logiciels/Licence.CeCILL-V2.pdf
+#
+"""Test pyqonsole's snapshot module.
+"""
+import unittest
+from cStringIO import StringIO
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from utils import NullGui
+
+from pyqonsole import emuVt102, emulation, snapshot
+from pyqonsole.ca import Ca, DCA
+from pyqonsole.history import HistoryTypeBuffer
+
+
+class LineEncodingTC(unittest.TestCase):
+
+    def test_roundtrip(self):
+        cells = [Ca(u'a'), Ca(u'b', 3, 4, 5), Ca(u'\u4e00', 3, 4, 5),
+                 Ca(None, 3, 4, 5), DCA, DCA]
+        data = snapshot.encodeLine(cells)
+        cache = snapshot._newCache()
+        decoded = snapshot.decodeLine(data, 0, len(data), cache)
+        self.failUnlessEqual(decoded, cells)
+        self.failUnless(decoded[-1] is DCA)
+        self.failUnless(snapshot.decodeLine(data, 0, len(data), cache)[1]
+                        is decoded[1])
+
+    def test_empty(self):
+        data = snapshot.encodeLine([])
+        self.failUnlessEqual(snapshot.decodeLine(data, 0, len(data), {}), [])
+
+
+class SnapshotTC(unittest.TestCase):
+
+    def setUp(self):
+        self.emu = self._emulation()
+        self.emu.setHistory(HistoryTypeBuffer(100))
+        self.tmpdir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def _emulation(self):
+        emu = emuVt102.EmuVt102(NullGui())
+        emu._connected = True
+        return emu
+
+    def _send(self, emu, seq):
+        for c in seq:
+            emu.onRcvChar(ord(c))
+
+    def _lines(self, emu):
+        image, wrapped = emu._scr.getCookedImage()
+        return image, wrapped
+
+    def _fill(self):
+        emu = self.emu
+        for i in xrange(80):
+            self._send(emu, 'line %s\r\n' % i)
+        self._send(emu, '\033[1;31mred\033[0m \033[4;7r\033[?1h\033(0q')
+
+    def test_dump_load(self):
+        self._fill()
+        stream = StringIO()
+        snapshot.dump(self.emu, stream)
+        emu = self._emulation()
+        snapshot.load(emu, stream.getvalue())
+        self.failUnlessEqual(self._lines(emu), self._lines(self.emu))
+        scr, orig = emu._scr, self.emu._scr
+        self.failUnlessEqual(scr.getHistLines(), orig.getHistLines())
+        self.failUnlessEqual([scr._hist.getLine(i)
+                              for i in xrange(scr.getHistLines())],
+                             [orig._hist.getLine(i)
+                              for i in xrange(orig.getHistLines())])
+        self.failUnlessEqual((scr.getCursorX(), scr.getCursorY()), (1, 0))
+        self.failUnlessEqual(scr.getMargins(), (3, 6))
+        self.failUnless(emu.getMode(emuVt102.MODE_AppCuKeys))
+        self.failUnless(emu._screen[1] is None)
+        # the vt100 graphics charset is still used
+        self._send(emu, 'q')
+        self._send(self.emu, 'q')
+        self.failUnlessEqual(self._lines(emu), self._lines(self.emu))
+
+    def test_alternate_screen(self):
+        self._send(self.emu, 'primary\033[?1049halternate')
+        stream = StringIO()
+        snapshot.dump(self.emu, stream)
+        emu = self._emulation()
+        snapshot.load(emu, stream.getvalue())
+        self.failUnless(emu._scr is emu._screen[1])
+        self.failUnlessEqual(self._lines(emu), self._lines(self.emu))
+        self._send(emu, '\033[?1049l')
+        self.failUnlessEqual(emu._screen[0].getCookedImage()[0][0][0].c, u'p')
+
+    def test_save_restore(self):
+        self._fill()
+        filename = join(self.tmpdir, 'snapshot')
+        snapshot.save(self.emu, filename)
+        emu = self._emulation()
+        snapshot.restore(emu, filename)
+        hist = emu._scr._hist
+        self.failUnlessEqual(hist.getStoredLine(0)[1], 0)
+        self.failUnlessEqual(hist.getLineLen(0), 6)
+        # lines are decoded when displayed
+        emu._scr.hist_cursor = self.emu._scr.hist_cursor = hist.lines - 1
+        self.failUnlessEqual(self._lines(emu), self._lines(self.emu))
+        self.failIf(hist.getStoredLine(hist.lines - 1))
+        self.failUnless(hist.getStoredLine(0))
+        # lines which haven't been loaded are copied as is
+        stream = StringIO()
+        snapshot.dump(emu, stream)
+        expected = StringIO()
+        snapshot.dump(self.emu, expected)
+        self.failUnlessEqual(stream.getvalue(), expected.getvalue())
+        # the file may be replaced while used
+        snapshot.save(emu, filename)
+        self.failUnlessEqual(hist.getLine(0), self.emu._scr._hist.getLine(0))
+
+    def test_invalid(self):
+        emu = self._emulation()
+        self.assertRaises(snapshot.SnapshotError, snapshot.load, emu, '')
+        self.assertRaises(snapshot.SnapshotError, snapshot.load, emu,
+                          'not a snapshot' * 10)
+        filename = join(self.tmpdir, 'empty')
+        open(filename, 'w').close()
+        self.assertRaises(snapshot.SnapshotError, snapshot.restore, emu,
+                          filename)
+
+
+class HibernationTC(unittest.TestCase):
+
+    def setUp(self):
+        self.emu = emuVt102.EmuVt102(NullGui())
+        self.emu.setHistory(HistoryTypeBuffer(100))
+        self.ref = emuVt102.EmuVt102(NullGui())
+        self.ref.setHistory(HistoryTypeBuffer(100))
+        for emu in (self.emu, self.ref):
+            for i in xrange(80):
+                emu.onRcvBlock('line %s\r\n' % i)
+
+    def _lines(self, emu):
+        return emu._scr.getCookedImage()
+
+    def test_not_while_connected(self):
+        self.emu.setConnect(True)
+        self.emu.hibernate()
+        self.failIf(self.emu.isHibernating())
+        self.failUnlessEqual(self.emu.hibernatedSize(), 0)
+
+    def test_wake_up_on_connect(self):
+        self.emu.hibernate()
+        self.failUnless(self.emu.isHibernating())
+        self.failUnless(self.emu._scr is None)
+        self.failUnless(self.emu.hibernatedSize() > 0)
+        self.failUnlessEqual(self.emu.historySize(), self.ref.historySize())
+        self.emu.setConnect(True)
+        self.failIf(self.emu.isHibernating())
+        self.failUnlessEqual(self.emu.refreshes, 1)
+        self.failUnlessEqual(self._lines(self.emu), self._lines(self.ref))
+
+    def test_wake_up_on_output(self):
+        self.emu.hibernate()
+        self.emu.onRcvBlock('\033[1;31mred')
+        self.ref.onRcvBlock('\033[1;31mred')
+        self.failIf(self.emu.isHibernating())
+        self.failUnlessEqual(self._lines(self.emu), self._lines(self.ref))
+        hist = self.emu._scr._hist
+        self.failUnlessEqual([hist.getLine(i) for i in xrange(hist.lines)],
+                             [self.ref._scr._hist.getLine(i)
+                              for i in xrange(hist.lines)])
+
+    def test_hibernate_delay(self):
+        self.emu.setHibernateDelay(0)
+        self.emu.setConnect(False)
+        self.failIf(self.emu._hibernate_timer.isActive())
+        self.emu.setHibernateDelay(1000)
+        self.failUnless(self.emu._hibernate_timer.isActive())
+        self.emu.setConnect(True)
+        self.failIf(self.emu._hibernate_timer.isActive())
+
+    def test_hibernate_once_idle(self):
+        self.emu.setConnect(False)
+        self.emu.hibernateTimerDone()
+        self.failIf(self.emu.isHibernating())
+        self.emu._last_output -= emulation.HIBERNATE_DELAY / 1000.
+        self.emu.onRcvBlock('more')
+        self.emu.hibernateTimerDone()
+        self.failIf(self.emu.isHibernating())
+        self.emu._last_output -= emulation.HIBERNATE_DELAY / 1000.
+        self.emu.hibernateTimerDone()
+        self.failUnless(self.emu.isHibernating())
+        # the check goes on while disconnected
+        self.failUnless(self.emu._hibernate_timer.isActive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,6 +13,7 @@ __revision__ = '$Id: test_wcwidth.py,v 1.7 2006-02-15 10:24:02 alf Exp $'
 
 ## http://www.cl.cam.ac.uk/~mgk25/ucs/scw-proposal.html is the right place
 
+from pyqonsole import helpers
 from pyqonsole.helpers import wcWidth
 import unittest
 import unicodedata as udata
@@ -143,6 +144,29 @@ class Wcwidth_TC(unittest.TestCase):
         # This test fails because of problems in unidata
         self.check_range(single_width, 1)
                                                
+class Implementations_TC(unittest.TestCase):
+    """The width table and the python implementation must give the same
+    results as the C one."""
+
+    def testTable(self):
+        failures = [cp for cp in xrange(0x10000)
+                    if helpers.WIDTHS[cp] != helpers._pyWcWidth(cp)]
+        self.assertEquals(failures, [])
+
+    def testPython(self):
+        try:
+            from pyqonsole._helpers import wcWidth as cWcWidth
+        except ImportError:
+            return
+        failures = [cp for cp in xrange(0x110000)
+                    if cWcWidth(cp) != helpers._pyWcWidth(cp)]
+        self.assertEquals(failures, [])
+
+    def testWcWidths(self):
+        self.assertEquals(helpers.wcWidths(u'a\u4e00\u0301\x01'),
+                          [1, 2, 0, -1])
+        self.assertEquals(helpers.wcWidths(u''), [])
+
 class UnidataErrors_TC(unittest.TestCase):
     """The tests below fail because of an error in unicodedata.
 
@@ -47,7 +47,7 @@ from pyqonsole.qtwrapper import *
 
 from pyqonsole import Signalable
 from pyqonsole.ca import DCA, RE_CURSOR, RE_BLINK, RE_UNDERLINE, \
-     TABLE_COLORS, DEFAULT_BACK_COLOR, ColorEntry
+     TABLE_COLORS, DEFAULT_BACK_COLOR, ColorEntry, VT100_GRAPHICS
 
 # FIXME: the rim should normally be 1, 0 only when running in full screen mode.
 rimX = 0 # left/right rim width
@@ -113,25 +113,7 @@ BASE_COLOR_TABLE = [
 
 # Font ########################################################################
 
-#   The VT100 has 32 special graphical characters. The usual vt100 extended
-#   xterm fonts have these at 0x00..0x1f.
-#
-#   QT's iso mapping leaves 0x00..0x7f without any changes. But the graphicals
-#   come in here as proper unicode characters.
-#
-#   We treat non-iso10646 fonts as VT100 extended and do the requiered mapping
-#   from unicode to 0x00..0x1f. The remaining translation is then left to the
-#   QCodec.
-
-# assert for i in [0..31] : vt100extended(vt100_graphics[i]) == i.
-
-VT100_GRAPHICS = [
-    # 0/8     1/9    2/10    3/11    4/12    5/13    6/14    7/15
-    0x0020, 0x25C6, 0x2592, 0x2409, 0x240c, 0x240d, 0x240a, 0x00b0,
-    0x00b1, 0x2424, 0x240b, 0x2518, 0x2510, 0x250c, 0x2514, 0x253c,
-    0xF800, 0xF801, 0x2500, 0xF803, 0xF804, 0x251c, 0x2524, 0x2534,
-    0x252c, 0x2502, 0x2264, 0x2265, 0x03C0, 0x2260, 0x00A3, 0x00b7,
-]
+#   See VT100_GRAPHICS in the ca module.
 
         
 class Widget(Signalable, qt.QFrame):
@@ -149,8 +131,14 @@ class Widget(Signalable, qt.QFrame):
         self.blinking = False
         # has characters to blink
         self.has_blinker = False
+        # foreground and background colors swapped (DECSCNM)
+        self.reverse_video = False
         # hide cursor in paintEvent
         self.cursor_blinking = False
+        # progress dialog of large pastes
+        self._paste_dialog = None
+        # lines of text displayed over the image (see setOverlay)
+        self._overlay = None
         # active when self.has_blinker
         self.blink_t = QTimer(self)
         # active when self.has_blinking_cursor
@@ -170,6 +158,8 @@ class Widget(Signalable, qt.QFrame):
         self.lines, self.columns = 1, 1
         self._image = None  # [lines][columns]
         self._line_wrapped = [] # QBitArray
+        # rows of the image having blinking characters
+        self._blink_rows = []
 
         self.color_table = [None] * TABLE_COLORS
 
@@ -284,22 +274,40 @@ class Widget(Signalable, qt.QFrame):
         self.setVTFont(self.font()) # Trigger an update.
 
     def emitSelection(self, useXselection, appendReturn):
-        """Paste Clipboard by simulating keypress events"""
+        """Paste Clipboard, the emulation sends it to the pty by chunks"""
         qt.QApplication.clipboard().setSelectionMode(useXselection)
         text = qt.QApplication.clipboard().text()
         if appendReturn:
             text.append("\r")
         if not text.isEmpty():
             text.replace(QRegExp("\n"), "\r")
-        ev = qt.QKeyEvent(QEvent.KeyPress, 0, -1, 0, text)
-        self.myemit('keyPressedSignal', (ev,)) # expose as a big fat keypress event
+            self.myemit('pasteSignal', (text,))
         self.myemit('clearSelectionSignal')
         qt.QApplication.clipboard().setSelectionMode(False)
   
     def emitText(self,  text):
         if not text.isEmpty():
-            ev = qt.QKeyEvent(QEvent.KeyPress, 0, -1, 0, text)
-            self.myemit('keyPressedSignal', (ev,)) # expose as a big fat keypress event
+            self.myemit('pasteSignal', (text,))
+
+    def pasteProgress(self, sent, total):
+        """Display operation - progress of a large paste, with a dialog
+        allowing to cancel it
+        """
+        if self._paste_dialog is None:
+            if sent >= total:
+                return
+            self._paste_dialog = qt.QProgressDialog("Pasting...", "Cancel",
+                                                    total / 1024, self)
+            self.connect(self._paste_dialog, SIGNAL('cancelled()'),
+                         self.cancelPaste)
+        self._paste_dialog.setProgress(sent / 1024)
+        if sent >= total:
+            self._paste_dialog.hide()
+            self._paste_dialog.deleteLater()
+            self._paste_dialog = None
+
+    def cancelPaste(self):
+        self.myemit('cancelPasteSignal')
 
     def setImage(self, newimg, lines, columns):
         """Display Operation - The image can only be set completely.
@@ -317,13 +325,20 @@ class Widget(Signalable, qt.QFrame):
         cf = cb = cr  = -1 # undefined
         cols = min(self.columns, max(0, columns))
         oldimg = self._image
+        blink_rows = self._blink_rows
         #print 'setimage', lins, cols, self.lines, self.columns, len(oldimg), len(newimg)
         for y in xrange(min(self.lines,  max(0, lines))):
             if self.resizing: # while resizing, we're expecting a paintEvent
                 break
+            # the emulation gives the same row again when it didn't change
+            if newimg[y] is oldimg[y]:
+                self.has_blinker |= blink_rows[y]
+                continue
+            blink_rows[y] = False
             x = 0
             while x < cols:
                 ca = newimg[y][x]
+                blink_rows[y] |= ca.r & RE_BLINK
                 self.has_blinker |= ca.r & RE_BLINK
                 # "is" to be more effective than "==" when possible
                 if ca is oldimg[y][x] or ca == oldimg[y][x]:
@@ -359,6 +374,7 @@ class Widget(Signalable, qt.QFrame):
                                  unistr, ca, pm != None, True)
                 x += xlen
         self._image = newimg
+        self._drawOverlay(paint)
         self.drawFrame(paint)
         paint.end()
         self.setUpdatesEnabled(True)
@@ -398,6 +414,15 @@ class Widget(Signalable, qt.QFrame):
     def setLineWrapped(self, _line_wrapped):
         self._line_wrapped = _line_wrapped
 
+    def setReverseVideo(self, reverse):
+        """Display Operation - swap foreground and background colors of the
+        whole image
+        """
+        reverse = bool(reverse)
+        if reverse != self.reverse_video:
+            self.reverse_video = reverse
+            self.update()
+
     def setCursorPos(self, curx, cury):
         """Display Operation - Set XIM Position"""
         tL  = self.contentsRect().topLeft()
@@ -574,18 +599,45 @@ class Widget(Signalable, qt.QFrame):
             self.connect(cb, SIGNAL('dataChanged()'), self.onClearSelection)
         return qt.QFrame.eventFilter(self, obj, e)
 
+    def setOverlay(self, lines):
+        """Display operation - show the given lines of text over the top right
+        corner of the image, or remove them if lines is None. Used to display
+        debugging information.
+        """
+        self._overlay = lines
+        self.update()
+
+    def _drawOverlay(self, paint):
+        if not self._overlay:
+            return
+        fm = self.fontMetrics()
+        width = max([fm.width(line) for line in self._overlay]) + 4
+        height = self.font_h * len(self._overlay) + 4
+        cr = self.contentsRect()
+        rect = QRect(cr.right() - self.bX - width, cr.top() + self.bY,
+                     width, height)
+        # reversed default colors
+        paint.fillRect(rect, self.color_table[0].color)
+        paint.setPen(self.color_table[1].color)
+        for i, line in enumerate(self._overlay):
+            paint.drawText(rect.x() + 2,
+                           rect.y() + 2 + self.font_a + i * self.font_h, line)
+
     def drawAttrStr(self, paint, rect, qstr, attr, pm, clear):
         """Display Operation - attributed string draw primitive"""
         #print attr.b, attr.f
+        f, b = attr.f, attr.b
+        if self.reverse_video:
+            f, b = b, f
         if (attr.r & RE_CURSOR) and self.hasFocus() and (not self.has_blinking_cursor or not self.cursor_blinking):
-            fColor = self.color_table[attr.b].color
-            bColor = self.color_table[attr.f].color
+            fColor = self.color_table[b].color
+            bColor = self.color_table[f].color
         else:
-            fColor = self.color_table[attr.f].color
-            bColor = self.color_table[attr.b].color
+            fColor = self.color_table[f].color
+            bColor = self.color_table[b].color
         if attr.r & RE_CURSOR:
             self._cursor_rect = rect
-        if pm and self.color_table[attr.b].transparent and (not (attr.r & RE_CURSOR) or self.cursor_blinking):
+        if pm and self.color_table[b].transparent and (not (attr.r & RE_CURSOR) or self.cursor_blinking):
             paint.setBackgroundMode(self.TransparentMode)
             if clear:
                 self.erase(rect)
@@ -600,9 +652,9 @@ class Widget(Signalable, qt.QFrame):
                 self.erase(rect)
             paint.setPen(fColor)
             paint.drawText(rect.x(), rect.y()+self.font_a, qstr)
-            if (attr.r & RE_UNDERLINE) or self.color_table[attr.f].bold:
+            if (attr.r & RE_UNDERLINE) or self.color_table[f].bold:
                 paint.setClipRect(rect)
-                if self.color_table[attr.f].bold:
+                if self.color_table[f].bold:
                     paint.setBackgroundMode(self.TransparentMode)
                     paint.drawText(rect.x()+1, rect.y()+self.font_a, qstr) # second stroke
                 if attr.r & RE_UNDERLINE:
@@ -610,7 +662,7 @@ class Widget(Signalable, qt.QFrame):
                                    rect.right(), rect.y()+self.font_a+1)
                 paint.setClipping(False)
         if (attr.r & RE_CURSOR) and not self.hasFocus():
-            if pm and self.color_table[attr.b].transparent:
+            if pm and self.color_table[b].transparent:
                 self.erase(rect)
                 paint.setBackgroundMode(self.TransparentMode)
                 paint.drawText(rect.x(), rect.y()+self.font_a, qstr)
@@ -674,6 +726,7 @@ class Widget(Signalable, qt.QFrame):
                                  QRect(self.bX+tLx+self.font_w*x, self.bY+tLy+self.font_h*y, self.font_w*xlen, self.font_h),
                                  unistr, ca, pm != None, False)
                 x += xlen
+        self._drawOverlay(paint)
         self.drawFrame(paint)
         paint.end()
         self.setUpdatesEnabled(True)
@@ -1010,6 +1063,7 @@ class Widget(Signalable, qt.QFrame):
         """initialize the image, for internal use only"""
         self._image = [[DCA for _ in xrange(self.columns)]
                        for _ in xrange(self.lines)]
+        self._blink_rows = [False] * self.lines
 
     def _makeImage(self):
         # calculate geometry first